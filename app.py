@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+import json
 import uuid
 import re
 import os
@@ -6,10 +7,18 @@ import time
 from dotenv import load_dotenv, dotenv_values
 from werkzeug.utils import secure_filename
 from models.vector_store import VectorStore
+from models.document_registry import DocumentRegistry, TextFingerprint, fingerprint_bytes, fingerprint_text
+from models.state_store import create_state_store, STATE_DB
 from services.llm_service import LLMService
-from services.pdf_extraction_service import extract_from_pdf
-from services.website_extraction_service import extract_content_from_website
-from services.monitoring_service import log_request, record_feedback
+from models.chunker import HeadingPath, split_sections
+from services.pdf_extraction_service import open_pdf, iter_pdf_pages, extract_pdf_tables, get_pdf_outline, PDF_TABLE_BACKEND
+from services.website_extraction_service import extract_content_from_website, get_stats as get_website_stats
+from services.crawl_service import crawl_site, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, CRAWL_PAGE_LIMIT
+from services.monitoring_service import log_request, record_feedback, get_metrics
+from services.ingestion_service import IngestionJobManager
+from services.session_manager import SessionManager
+from services.answer_cache import AnswerCache
+from services.table_processing import prepare_tables, get_stats as get_table_stats
 
 load_dotenv(override=True)
 
@@ -26,16 +35,363 @@ app = Flask(__name__)
 vector_store = VectorStore()
 llm_service = LLMService(api_key)
 
+# Sessions, job status and document references go through one state store;
+# with STATE_DB set it is a SQLite file shared by all worker processes
+state_store = create_state_store()
+document_registry = DocumentRegistry(vector_store.persist_directory, store=state_store if STATE_DB else None)
+ingestion_jobs = IngestionJobManager(store=state_store)
+answer_cache = AnswerCache()
+
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
-# Per-session state keyed by client-generated session ID
-_sessions = {}
+# Streamed PDF pages are embedded in batches of roughly this many characters
+PAGE_BATCH_CHARS = 20000
+
+def _release_session(session):
+    # Evicted sessions give up their document references; documents no other
+    # session holds are dropped from the index in one delete
+    orphaned = [custom_id for custom_id in session['uploads'] if document_registry.release(custom_id)]
+    vector_store.delete_documents_by_custom_ids(orphaned)
+    for custom_id in orphaned:
+        answer_cache.invalidate(custom_id)
+
+# Per-session state keyed by client-generated session ID, with idle and
+# memory-budget eviction
+sessions = SessionManager(on_evict=_release_session, chunk_count=document_registry.chunk_count, store=state_store)
+
+def _session_id():
+    return request.headers.get('X-Session-Id', 'default')
 
 def _get_session_data():
-    sid = request.headers.get('X-Session-Id', 'default')
-    if sid not in _sessions:
-        _sessions[sid] = {'chat_history': [], 'uploads': {}}
-    return _sessions[sid]
+    return sessions.get(_session_id())
+
+def _index_text(text, custom_id, doc_type, chunk_ids=None, table=None):
+    # chunk_ids, when given, collects the IDs of every chunk the text maps to
+    ids = vector_store.add_text_to_rag(text, custom_id, doc_type=doc_type, table=table)
+    if chunk_ids is not None:
+        chunk_ids.update(ids)
+
+def _ingest_tables(job, tables, custom_id, start, end, chunk_ids=None, known_tables=None):
+    # Table LLM calls report progress between start and end percent. Tables
+    # whose fingerprint is in known_tables (fingerprint -> stored chunk IDs)
+    # keep their chunks without another LLM call.
+    known_tables = known_tables or {}
+    pending = []
+    for table in tables:
+        table_fingerprint = fingerprint_text(table['text'])
+        if table_fingerprint in known_tables:
+            if chunk_ids is not None:
+                chunk_ids.update(known_tables[table_fingerprint])
+        else:
+            pending.append((table, table_fingerprint))
+
+    job.update('processing tables', start)
+    results = llm_service.extract_info_from_tables(
+        [table for table, _ in pending],
+        on_progress=lambda done, total: job.update(progress=start + (end - start) * done / total),
+        cancel_event=job.cancel_event,
+    )
+    for (table, table_fingerprint), ans in zip(pending, results):
+        if ans == False or ans == None:
+            continue
+        job.update()
+        _index_text([{'text': ans, 'page': table.get('page')}], custom_id, 'Table', chunk_ids,
+                    table=table_fingerprint)
+
+def _ingest_pdf_pages(job, doc, custom_id, table_dataframes=None, end=60, chunk_ids=None):
+    # Embed pages as they are parsed instead of after the whole document;
+    # only the current batch of page text is held in memory. Tables found on
+    # the way are collected into table_dataframes when a list is given.
+    # Chunks stay within a page and an outline section; their offsets count
+    # from the start of the document (pages joined by newlines).
+    fingerprint = TextFingerprint()
+    outline = get_pdf_outline(doc)
+    path = HeadingPath()
+    offset = 0
+    batch = []
+    batch_chars = 0
+    page_count = max(1, len(doc))
+    for page in iter_pdf_pages(doc, find_tables=table_dataframes is not None):
+        job.update('extracting text', end * page['page'] / page_count)
+        fingerprint.update(page['text'])
+        if table_dataframes is not None:
+            table_dataframes.extend(page['tables'])
+        batch.extend(split_sections(page['text'], outline.get(page['page'], []), path, offset,
+                                    apply_unmatched=True, page=page['page']))
+        offset += len(page['text']) + 1
+        batch_chars += len(page['text'])
+        if batch_chars >= PAGE_BATCH_CHARS:
+            _index_text(batch, custom_id, 'PDF', chunk_ids)
+            batch = []
+            batch_chars = 0
+    if batch:
+        _index_text(batch, custom_id, 'PDF', chunk_ids)
+    return fingerprint.hexdigest()
+
+def _extract_tables(raw, table_dataframes):
+    # Tables already read in the page pass, or a separate pass over the PDF
+    if table_dataframes is not None:
+        return prepare_tables(table_dataframes)
+    return extract_pdf_tables(raw)
+
+def _pdf_text_fingerprint(doc):
+    # Page text only, without tables, chunking or embedding: cheap enough to
+    # run before indexing so a duplicate is never embedded
+    fingerprint = TextFingerprint()
+    for page in iter_pdf_pages(doc):
+        fingerprint.update(page['text'])
+    return fingerprint.hexdigest()
+
+def _run_pdf_ingestion(job, sid, raw, raw_fingerprint, filename):
+    doc = open_pdf(raw)
+    job.update('extracting text', 1)
+
+    # Same text under different bytes: reuse the existing chunk set and skip
+    # embedding and the table LLM calls
+    text_fingerprint = _pdf_text_fingerprint(doc)
+    custom_id = document_registry.acquire_fingerprint(text_fingerprint)
+    duplicate = custom_id is not None
+
+    if not duplicate:
+        custom_id = str(uuid.uuid4())
+        try:
+            # The PyMuPDF table backend reads tables in the same page pass
+            table_dataframes = [] if PDF_TABLE_BACKEND == 'pymupdf' else None
+            _ingest_pdf_pages(job, doc, custom_id, table_dataframes)
+            job.update('extracting tables', 60)
+            _ingest_tables(job, _extract_tables(raw, table_dataframes), custom_id, 65, 95)
+        except Exception:
+            # Cancelled or failed: drop whatever was indexed for the new document
+            vector_store.delete_documents_by_custom_id(custom_id)
+            raise
+
+    if duplicate:
+        document_registry.register(custom_id, [raw_fingerprint, text_fingerprint])
+    else:
+        document_registry.register(custom_id, [raw_fingerprint, text_fingerprint], name=filename, type="PDF",
+                                   chunks=vector_store.count_chunks(custom_id))
+    # Attached by session ID in case the session was evicted while the job ran
+    _attach_document(sid, custom_id, filename, "PDF", acquired=duplicate)
+    return {
+        'message': 'PDF already processed, reusing it' if duplicate else 'PDF uploaded and processed',
+        'document': {'id': custom_id, 'name': filename, 'type': 'PDF'}
+    }
+
+def _run_website_ingestion(job, sid, url):
+    job.update('fetching', 5)
+    content = extract_content_from_website(url)
+
+    text_fingerprint = fingerprint_text(content['text'])
+    custom_id = document_registry.acquire_fingerprint(text_fingerprint)
+    duplicate = custom_id is not None
+
+    if not duplicate:
+        custom_id = str(uuid.uuid4())
+        try:
+            job.update('indexing text', 30)
+            _index_text(split_sections(content['text'], content['headings']), custom_id, 'Website')
+            _ingest_tables(job, content['tables'], custom_id, 50, 95)
+        except Exception:
+            vector_store.delete_documents_by_custom_id(custom_id)
+            raise
+        document_registry.register(custom_id, [text_fingerprint], name=url, type="Website",
+                                   chunks=vector_store.count_chunks(custom_id))
+
+    _attach_document(sid, custom_id, url, "Website", acquired=duplicate)
+    return {
+        'message': 'Website already processed, reusing it' if duplicate else 'Website processed',
+        'document': {'id': custom_id, 'name': url, 'type': 'Website'}
+    }
+
+def _crawl_pages(job, custom_id, url, max_depth, max_pages, allow_subdomains, chunk_ids=None):
+    # Page text is embedded in batches as pages arrive, each page chunked on
+    # its own so that pages arriving in a different order on a later crawl
+    # produce the same chunks; chunk offsets count within the page, which is
+    # recorded as 'url'. Tables are returned for the caller to process.
+    page_fingerprints = []
+    tables = []
+    batch = []
+    batch_chars = 0
+
+    def on_page(page_url, content):
+        nonlocal batch, batch_chars
+        job.update('crawling', 60 * (len(page_fingerprints) + 1) / max_pages)
+        page_fingerprints.append(fingerprint_text(content['text']))
+        tables.extend(content['tables'])
+        batch.extend(split_sections(content['text'], content['headings'], url=page_url))
+        batch_chars += len(content['text'])
+        if batch_chars >= PAGE_BATCH_CHARS:
+            _index_text(batch, custom_id, 'Website', chunk_ids)
+            batch = []
+            batch_chars = 0
+
+    job.update('crawling', 1)
+    stats = crawl_site(url, on_page, max_depth=max_depth, max_pages=max_pages,
+                       allow_subdomains=allow_subdomains, cancel_event=job.cancel_event)
+    job.update()
+    if batch:
+        _index_text(batch, custom_id, 'Website', chunk_ids)
+    if not page_fingerprints:
+        raise ValueError(f"Could not extract meaningful content from any page of {url}.")
+
+    # Same set of pages (in any order) gives the same site fingerprint
+    return stats, fingerprint_text(' '.join(sorted(page_fingerprints))), tables
+
+def _run_crawl_ingestion(job, sid, url, max_depth, max_pages, allow_subdomains):
+    # Every crawled page is indexed under one document ID, so the whole site
+    # is attached, shared and deleted as a single document. Tables wait until
+    # the crawl is done and the site is known not to be a duplicate.
+    new_id = custom_id = str(uuid.uuid4())
+    duplicate = False
+    try:
+        stats, site_fingerprint, tables = _crawl_pages(job, custom_id, url, max_depth, max_pages, allow_subdomains)
+        existing_id = document_registry.acquire_fingerprint(site_fingerprint)
+        if existing_id is not None:
+            vector_store.delete_documents_by_custom_id(new_id)
+            custom_id = existing_id
+            duplicate = True
+        else:
+            _ingest_tables(job, tables, custom_id, 65, 95)
+    except Exception:
+        vector_store.delete_documents_by_custom_id(new_id)
+        raise
+
+    if not duplicate:
+        # The crawl settings are kept so a refresh crawls the same pages
+        document_registry.register(custom_id, [site_fingerprint], name=url, type="Website crawl",
+                                   chunks=vector_store.count_chunks(custom_id), pages=stats['pages'],
+                                   crawl={'max_depth': max_depth, 'max_pages': max_pages,
+                                          'allow_subdomains': allow_subdomains})
+    _attach_document(sid, custom_id, url, "Website crawl", acquired=duplicate)
+    return {
+        'message': ('Site already crawled, reusing it' if duplicate
+                    else f"Crawled {stats['pages']} pages ({stats['failed']} failed)"),
+        'document': {'id': custom_id, 'name': url, 'type': 'Website crawl'},
+        'crawl': stats
+    }
+
+def _refresh_chunks(custom_id, reingest):
+    # Re-ingest under the same document ID. Chunk IDs are hashes of the chunk
+    # text, so unchanged chunks map onto stored ones and are not embedded
+    # again; only new chunks are embedded and only vanished ones deleted.
+    # reingest(chunk_ids, known_tables) fills chunk_ids with every chunk ID
+    # the new version maps to.
+    stored, known_tables = vector_store.stored_chunks(custom_id)
+    chunk_ids = set()
+    try:
+        result = reingest(chunk_ids, known_tables)
+    except Exception:
+        vector_store.delete_chunks(chunk_ids - stored)
+        raise
+
+    removed = stored - chunk_ids
+    vector_store.delete_chunks(removed)
+    if document_registry.get(custom_id) is None:
+        # Deleted by its last session while the refresh ran
+        vector_store.delete_documents_by_custom_id(custom_id)
+        raise ValueError("Document was deleted during the refresh")
+
+    changes = {'added': len(chunk_ids - stored), 'removed': len(removed), 'unchanged': len(chunk_ids & stored)}
+    if changes['added'] or changes['removed']:
+        answer_cache.invalidate(custom_id)
+    return result, changes
+
+def _refresh_result(custom_id, name, doc_type, changes):
+    if changes is None:
+        message = 'Document unchanged'
+        changes = {'added': 0, 'removed': 0, 'unchanged': vector_store.count_chunks(custom_id)}
+    else:
+        message = (f"Document refreshed: {changes['added']} chunks added, "
+                   f"{changes['removed']} removed, {changes['unchanged']} unchanged")
+    return {
+        'message': message,
+        'document': {'id': custom_id, 'name': name, 'type': doc_type},
+        'changes': changes
+    }
+
+def _run_pdf_refresh(job, sid, custom_id, raw, filename):
+    document = document_registry.get(custom_id)
+    if document is None:
+        raise ValueError("Document no longer exists")
+    raw_fingerprint = fingerprint_bytes(raw)
+    if raw_fingerprint in document['fingerprints']:
+        return _refresh_result(custom_id, filename, "PDF", None)
+
+    def reingest(chunk_ids, known_tables):
+        table_dataframes = [] if PDF_TABLE_BACKEND == 'pymupdf' else None
+        text_fingerprint = _ingest_pdf_pages(job, open_pdf(raw), custom_id, table_dataframes, chunk_ids=chunk_ids)
+        job.update('extracting tables', 60)
+        _ingest_tables(job, _extract_tables(raw, table_dataframes), custom_id, 65, 95, chunk_ids, known_tables)
+        return text_fingerprint
+
+    text_fingerprint, changes = _refresh_chunks(custom_id, reingest)
+    document_registry.update(custom_id, [raw_fingerprint, text_fingerprint], name=filename,
+                             chunks=vector_store.count_chunks(custom_id))
+    def rename(sess):
+        if custom_id in sess['uploads']:
+            sess['uploads'][custom_id]['name'] = filename
+    sessions.update(sid, rename)
+    return _refresh_result(custom_id, filename, "PDF", changes)
+
+def _run_website_refresh(job, sid, custom_id):
+    document = document_registry.get(custom_id)
+    if document is None:
+        raise ValueError("Document no longer exists")
+    url, doc_type = document['name'], document['type']
+
+    if doc_type == "Website crawl":
+        settings = document.get('crawl', {})
+
+        def reingest(chunk_ids, known_tables):
+            stats, site_fingerprint, tables = _crawl_pages(
+                job, custom_id, url, settings.get('max_depth', CRAWL_MAX_DEPTH),
+                settings.get('max_pages', CRAWL_MAX_PAGES), settings.get('allow_subdomains', False), chunk_ids)
+            _ingest_tables(job, tables, custom_id, 65, 95, chunk_ids, known_tables)
+            return stats, site_fingerprint
+
+        (stats, site_fingerprint), changes = _refresh_chunks(custom_id, reingest)
+        document_registry.update(custom_id, [site_fingerprint], chunks=vector_store.count_chunks(custom_id),
+                                 pages=stats['pages'])
+        return _refresh_result(custom_id, url, doc_type, changes)
+
+    job.update('fetching', 5)
+    content = extract_content_from_website(url)
+    text_fingerprint = fingerprint_text(content['text'])
+    if text_fingerprint in document['fingerprints']:
+        return _refresh_result(custom_id, url, doc_type, None)
+
+    def reingest(chunk_ids, known_tables):
+        job.update('indexing text', 30)
+        _index_text(split_sections(content['text'], content['headings']), custom_id, 'Website', chunk_ids)
+        _ingest_tables(job, content['tables'], custom_id, 50, 95, chunk_ids, known_tables)
+
+    _, changes = _refresh_chunks(custom_id, reingest)
+    document_registry.update(custom_id, [text_fingerprint], chunks=vector_store.count_chunks(custom_id))
+    return _refresh_result(custom_id, url, doc_type, changes)
+
+def _attach_document(sid, custom_id, name, doc_type, acquired=False):
+    # Each session holds one reference to a shared document. Duplicates come
+    # with the reference taken at lookup (acquired), which is given back if
+    # the session already holds one.
+    def attach(sess):
+        if custom_id not in sess['uploads']:
+            if not acquired:
+                document_registry.acquire(custom_id)
+        elif acquired:
+            document_registry.release(custom_id)
+        sess['uploads'][custom_id] = {
+            "name": name,
+            "type": doc_type
+        }
+    sessions.update(sid, attach)
+
+def _document_versions(doc_ids):
+    # Documents may have been added, refreshed or deleted by another worker
+    # process: bring this process's BM25 index up to date, and key cached
+    # answers by the versions they were computed from
+    versions = document_registry.versions(doc_ids)
+    vector_store.sync_lexical(versions)
+    return tuple(sorted(versions.items()))
 
 
 @app.route('/')
@@ -52,9 +408,22 @@ def feedback():
         return jsonify({'status': 'success'})
     return jsonify({'status': 'error', 'message': 'Missing query_id or feedback field'}), 400
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'status': 'success',
+        'log_shipping': get_metrics(),
+        'embedding_cache': vector_store.embedding_cache.stats(),
+        'embedding': vector_store.embedding_stats(),
+        'tables': get_table_stats(),
+        'website_fetches': get_website_stats(),
+        'ingestion': ingestion_jobs.stats(),
+        'answer_cache': answer_cache.stats(),
+        'sessions': sessions.stats()
+    })
+
 @app.route('/upload_pdf', methods=['POST'])
 def upload_pdf():
-    data = _get_session_data()
     if 'file' not in request.files:
         return jsonify({'status': 'error', 'message': 'No file part'})
 
@@ -66,84 +435,123 @@ def upload_pdf():
     if file and file.filename.endswith('.pdf'):
         filename = secure_filename(file.filename)
 
-        content = extract_from_pdf(file)
-
-        custom_id = str(uuid.uuid4())
-
-        vector_store.add_text_to_rag(content['text'], custom_id)
-        for table in content['tables']:
-            ans = llm_service.extract_info_from_table(table)
-            if ans == False or ans == None:
-                continue
-            vector_store.add_text_to_rag(ans, custom_id)
-
-        data['uploads'][custom_id] = {
-            "name": filename,
-            "type": "PDF"
-        }
-
+        # Identical bytes reuse the stored chunks without queueing a job
+        raw = file.read()
+        raw_fingerprint = fingerprint_bytes(raw)
+        custom_id = document_registry.acquire_fingerprint(raw_fingerprint)
+
+        if custom_id is not None:
+            _attach_document(_session_id(), custom_id, filename, "PDF", acquired=True)
+            return jsonify({
+                'status': 'success',
+                'message': 'PDF already processed, reusing it',
+                'document': {
+                    'id': custom_id,
+                    'name': filename,
+                    'type': 'PDF'
+                }
+            })
+
+        job = ingestion_jobs.submit('pdf', _session_id(), filename, _run_pdf_ingestion,
+                                    _session_id(), raw, raw_fingerprint, filename)
         return jsonify({
-            'status': 'success',
-            'message': 'PDF uploaded and processed',
-            'document': {
-                'id': custom_id,
-                'name': filename,
-                'type': 'PDF'
-            }
-        })
+            'status': 'accepted',
+            'message': 'PDF queued for processing',
+            'job_id': job.id
+        }), 202
 
     return jsonify({'status': 'error', 'message': 'Invalid file type'})
 
 @app.route('/process_website', methods=['POST'])
 def process_website():
-    sess = _get_session_data()
     req_data = request.get_json()
     url = req_data.get('url')
 
     if not url:
         return jsonify({'status': 'error', 'message': 'No URL provided'})
 
-    try:
-        content = extract_content_from_website(url)
-
-        custom_id = str(uuid.uuid4())
+    # Crawl mode follows same-domain links from the seed URL
+    if req_data.get('crawl'):
+        try:
+            max_depth = max(0, int(req_data.get('max_depth', CRAWL_MAX_DEPTH)))
+            max_pages = max(1, min(int(req_data.get('max_pages', CRAWL_MAX_PAGES)), CRAWL_PAGE_LIMIT))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'max_depth and max_pages must be integers'})
+        job = ingestion_jobs.submit('crawl', _session_id(), url, _run_crawl_ingestion, _session_id(), url,
+                                    max_depth, max_pages, bool(req_data.get('allow_subdomains')))
+        return jsonify({
+            'status': 'accepted',
+            'message': 'Site crawl queued',
+            'job_id': job.id
+        }), 202
+
+    job = ingestion_jobs.submit('website', _session_id(), url, _run_website_ingestion, _session_id(), url)
+    return jsonify({
+        'status': 'accepted',
+        'message': 'Website queued for processing',
+        'job_id': job.id
+    }), 202
+
+@app.route('/refresh_document', methods=['POST'])
+def refresh_document():
+    # Websites and crawls are fetched again from their URL; a PDF's new
+    # version is uploaded as a form with the document ID
+    sess = _get_session_data()
+    req_data = request.form if request.files else (request.get_json(silent=True) or {})
+    custom_id = req_data.get('id')
 
-        vector_store.add_text_to_rag(content['text'], custom_id)
-        for table in content['tables']:
-            ans = llm_service.extract_info_from_table(table)
-            if ans == False or ans == None:
-                continue
-            vector_store.add_text_to_rag(ans, custom_id)
+    if not custom_id:
+        return jsonify({'status': 'error', 'message': 'No document ID provided'})
 
-        sess['uploads'][custom_id] = {
-            "name": url,
-            "type": "Website"
-        }
+    document = document_registry.get(custom_id)
+    if custom_id not in sess['uploads'] or document is None:
+        return jsonify({'status': 'error', 'message': 'Document not found'})
 
-        return jsonify({
-            'status': 'success',
-            'message': 'Website processed',
-            'document': {
-                'id': custom_id,
-                'name': url,
-                'type': 'Website'
-            }
-        })
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Error processing website: {str(e)}'})
+    if document.get('type') == "PDF":
+        file = request.files.get('file')
+        if file is None or not file.filename.endswith('.pdf'):
+            return jsonify({'status': 'error', 'message': 'Upload the new version of the PDF to refresh it'})
+        filename = secure_filename(file.filename)
+        job = ingestion_jobs.submit('refresh', _session_id(), filename, _run_pdf_refresh,
+                                    _session_id(), custom_id, file.read(), filename)
+    elif document.get('type') in ("Website", "Website crawl"):
+        job = ingestion_jobs.submit('refresh', _session_id(), document['name'], _run_website_refresh,
+                                    _session_id(), custom_id)
+    else:
+        return jsonify({'status': 'error', 'message': 'This document cannot be refreshed'})
+
+    return jsonify({
+        'status': 'accepted',
+        'message': 'Refresh queued',
+        'job_id': job.id
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingestion_jobs.get(job_id, owner=_session_id())
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if ingestion_jobs.cancel(job_id, owner=_session_id()):
+        return jsonify({'status': 'success', 'message': 'Cancellation requested'})
+    return jsonify({'status': 'error', 'message': 'Job not found or already finished'})
 
 @app.route('/delete_document', methods=['POST'])
 def delete_document():
-    sess = _get_session_data()
     req_data = request.get_json()
     custom_id = req_data.get('id')
 
     if not custom_id:
         return jsonify({'status': 'error', 'message': 'No document ID provided'})
 
-    if custom_id in sess['uploads']:
-        vector_store.delete_documents_by_custom_id(custom_id)
-        del sess['uploads'][custom_id]
+    if sessions.update(_session_id(), lambda sess: sess['uploads'].pop(custom_id, None) is not None):
+        # Vectors are shared between sessions; drop them with the last reference
+        if document_registry.release(custom_id):
+            vector_store.delete_documents_by_custom_id(custom_id)
+            answer_cache.invalidate(custom_id)
         return jsonify({'status': 'success', 'message': 'Document deleted'})
 
     return jsonify({'status': 'error', 'message': 'Document not found'})
@@ -172,12 +580,23 @@ def ask_question():
     query_id = str(uuid.uuid4())
 
     try:
-        res = llm_service.ask_question(vector_store.vector_db, question)
+        # Near-identical questions over the same documents reuse the answer
+        # without retrieval or a Groq call
+        doc_ids = list(sess['uploads'])
+        version = _document_versions(doc_ids)
+        question_vector = vector_store.embeddings.embed_query(question)
+        res = answer_cache.lookup(question_vector, doc_ids, version)
+        cache_hit = res is not None
+        if cache_hit:
+            res = {**res, 'chunks_retrieved': 0, 'chunks_used': 0, 'tokens_input': 0, 'tokens_output': 0,
+                   'context_tokens_saved': 0}
+        else:
+            res = llm_service.ask_question(vector_store.vector_db, question, doc_ids, question_vector,
+                                           vector_store.lexical_index)
+            answer_cache.put(question_vector, doc_ids, {'result': res['result']}, version)
         response_text = res['result']
         response_html = convert_to_html(response_text)
-
-        sess['chat_history'].append({"role": "user", "content": question})
-        sess['chat_history'].append({"role": "assistant", "content": response_html})
+        chat_history = sessions.update(_session_id(), lambda sess: _append_chat(sess, question, response_html))
 
         latency = time.time() - start_time
 
@@ -188,19 +607,26 @@ def ask_question():
             latency=latency,
             tokens_input=res['tokens_input'],
             tokens_output=res['tokens_output'],
-            chunks_retrieved=res['chunks_count']
+            chunks_retrieved=res['chunks_retrieved'],
+            chunks_used=res['chunks_used'],
+            cache_hit=cache_hit,
+            context_tokens_saved=res['context_tokens_saved'],
+            chosen_k=res.get('chosen_k'),
+            retrieval_scores=res.get('retrieval_scores')
         )
 
         return jsonify({
             'status': 'success',
             'response': response_html,
             'query_id': query_id,
-            'chat_history': sess['chat_history'],
+            'chat_history': chat_history,
             'metrics': {
                 'latency': round(latency, 2),
-                'chunks_count': res['chunks_count'],
+                'chunks_count': res['chunks_used'],
                 'tokens_input': res['tokens_input'],
-                'tokens_output': res['tokens_output']
+                'tokens_output': res['tokens_output'],
+                'context_tokens_saved': res['context_tokens_saved'],
+                'cache_hit': cache_hit
             }
         })
     except Exception as e:
@@ -216,10 +642,110 @@ def ask_question():
         )
         return jsonify({'status': 'error', 'message': f'Error getting response: {str(e)}'})
 
+def _append_chat(sess, question, response_html):
+    sess['chat_history'].append({"role": "user", "content": question})
+    sess['chat_history'].append({"role": "assistant", "content": response_html})
+    return sess['chat_history']
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/ask_question_stream', methods=['POST'])
+def ask_question_stream():
+    # Same pipeline as /ask_question, but tokens are sent as Server-Sent
+    # Events while Groq generates them; a final 'done' event carries the
+    # rendered answer and metrics
+    sid = _session_id()
+    sess = _get_session_data()
+    start_time = time.time()
+    req_data = request.get_json()
+    question = req_data.get('question')
+
+    def generate():
+        if not question:
+            yield _sse('error', {'message': 'No question provided'})
+            return
+
+        if not sess['uploads']:
+            yield _sse('error', {'message': 'Please upload at least one document first'})
+            return
+
+        query_id = str(uuid.uuid4())
+
+        try:
+            doc_ids = list(sess['uploads'])
+            version = _document_versions(doc_ids)
+            question_vector = vector_store.embeddings.embed_query(question)
+            res = answer_cache.lookup(question_vector, doc_ids, version)
+            cache_hit = res is not None
+            if cache_hit:
+                # A cached answer is sent as a single token
+                res = {**res, 'chunks_retrieved': 0, 'chunks_used': 0, 'tokens_input': 0, 'tokens_output': 0,
+                       'context_tokens_saved': 0, 'ttft': time.time() - start_time}
+                yield _sse('token', {'text': res['result']})
+            else:
+                for event, payload in llm_service.stream_question(vector_store.vector_db, question, doc_ids,
+                                                                  question_vector, vector_store.lexical_index):
+                    if event == 'token':
+                        yield _sse('token', {'text': payload})
+                    else:
+                        res = payload
+                answer_cache.put(question_vector, doc_ids, {'result': res['result']}, version)
+
+            response_text = res['result']
+            response_html = convert_to_html(response_text)
+            sessions.update(sid, lambda sess: _append_chat(sess, question, response_html))
+
+            latency = time.time() - start_time
+
+            log_request(
+                query_id=query_id,
+                query=question,
+                answer=response_text,
+                latency=latency,
+                tokens_input=res['tokens_input'],
+                tokens_output=res['tokens_output'],
+                chunks_retrieved=res['chunks_retrieved'],
+                chunks_used=res['chunks_used'],
+                ttft=res['ttft'],
+                cache_hit=cache_hit,
+                context_tokens_saved=res['context_tokens_saved'],
+                chosen_k=res.get('chosen_k'),
+                retrieval_scores=res.get('retrieval_scores')
+            )
+
+            yield _sse('done', {
+                'response': response_html,
+                'query_id': query_id,
+                'metrics': {
+                    'latency': round(latency, 2),
+                    'ttft': round(res['ttft'], 2),
+                    'chunks_count': res['chunks_used'],
+                    'tokens_input': res['tokens_input'],
+                    'tokens_output': res['tokens_output'],
+                    'context_tokens_saved': res['context_tokens_saved'],
+                    'cache_hit': cache_hit
+                }
+            })
+        except Exception as e:
+            log_request(
+                query_id=query_id,
+                query=question,
+                answer=None,
+                latency=time.time() - start_time,
+                tokens_input=0,
+                tokens_output=0,
+                chunks_retrieved=0,
+                error=e
+            )
+            yield _sse('error', {'message': f'Error getting response: {str(e)}'})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/clear_chat', methods=['POST'])
 def clear_chat():
-    sess = _get_session_data()
-    sess['chat_history'] = []
+    sessions.update(_session_id(), lambda sess: sess.update(chat_history=[]))
     return jsonify({'status': 'success', 'message': 'Chat history cleared'})
 
 if __name__ == "__main__":
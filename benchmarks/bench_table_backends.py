@@ -0,0 +1,112 @@
+"""Compare PDF table extraction backends on a directory of fixture PDFs.
+
+Usage: python -m benchmarks.bench_table_backends [path/to/pdfs] [--repeat N]
+
+Without a directory, a fixed set of PDFs with ruled tables is generated
+first, so runs are reproducible on any machine.
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz
+from services.pdf_extraction_service import extract_pdf_tables, TABLE_BACKENDS
+
+# (file name, pages, ruled tables per page, rows per table)
+FIXTURES = [
+    ('small.pdf', 1, 1, 6),
+    ('medium.pdf', 5, 2, 10),
+    ('large.pdf', 20, 2, 15),
+]
+COLUMNS = ('Item', 'Region', 'Quarter', 'Units', 'Revenue')
+ROW_HEIGHT = 16
+COLUMN_WIDTH = 100
+
+
+def _draw_table(page, top, rows, seed):
+    cells = [COLUMNS] + [
+        (f"SKU-{seed:03d}-{row:02d}", ('North', 'South', 'East', 'West')[row % 4], f"Q{row % 4 + 1}",
+         str((seed * 37 + row * 11) % 500), f"{(seed * 53 + row * 29) % 9000 / 10:.1f}")
+        for row in range(rows)
+    ]
+    left = 50
+    for r, values in enumerate(cells):
+        y = top + r * ROW_HEIGHT
+        for c, value in enumerate(values):
+            page.insert_text((left + c * COLUMN_WIDTH + 4, y + 12), value, fontsize=9)
+    bottom = top + len(cells) * ROW_HEIGHT
+    right = left + len(COLUMNS) * COLUMN_WIDTH
+    for r in range(len(cells) + 1):
+        page.draw_line((left, top + r * ROW_HEIGHT), (right, top + r * ROW_HEIGHT))
+    for c in range(len(COLUMNS) + 1):
+        page.draw_line((left + c * COLUMN_WIDTH, top), (left + c * COLUMN_WIDTH, bottom))
+    return bottom
+
+
+def write_fixtures(out_dir):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, pages, tables_per_page, rows in FIXTURES:
+        doc = fitz.open()
+        for page_num in range(pages):
+            page = doc.new_page()
+            top = 60
+            page.insert_text((50, top - 20), f"Quarterly report, page {page_num + 1}", fontsize=12)
+            for table_num in range(tables_per_page):
+                top = _draw_table(page, top, rows, page_num * tables_per_page + table_num) + 40
+        doc.save(out_dir / name, deflate=True)
+        doc.close()
+
+
+def run(pdf_dir, backends, repeat):
+    pdfs = sorted(Path(pdf_dir).glob('*.pdf'))
+    if not pdfs:
+        print(f"No PDFs found in {pdf_dir}")
+        return
+
+    print(f"{'file':40} {'backend':10} {'tables':>6} {'best (s)':>9} {'mean (s)':>9}")
+    totals = {backend: 0.0 for backend in backends}
+    measured = {backend: 0 for backend in backends}
+    for pdf in pdfs:
+        data = pdf.read_bytes()
+        for backend in backends:
+            timings = []
+            tables = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    tables = extract_pdf_tables(data, backend=backend)
+                except Exception as e:
+                    print(f"{pdf.name[:40]:40} {backend:10} error: {e}")
+                    break
+                timings.append(time.perf_counter() - start)
+            if timings:
+                totals[backend] += min(timings)
+                measured[backend] += 1
+                print(f"{pdf.name[:40]:40} {backend:10} {len(tables):>6} "
+                      f"{min(timings):>9.3f} {sum(timings) / len(timings):>9.3f}")
+
+    print()
+    for backend, total in totals.items():
+        if measured[backend]:
+            print(f"{backend:10} total best time: {total:.3f}s over {measured[backend]} of {len(pdfs)} PDFs")
+        else:
+            print(f"{backend:10} failed on every PDF")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pdf_dir', nargs='?')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backends', nargs='+', default=list(TABLE_BACKENDS), choices=TABLE_BACKENDS)
+    args = parser.parse_args()
+    if args.pdf_dir:
+        run(args.pdf_dir, args.backends, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as fixture_dir:
+            write_fixtures(fixture_dir)
+            run(fixture_dir, args.backends, args.repeat)
@@ -0,0 +1,135 @@
+"""Compare website extraction against the previous implementation on saved HTML pages.
+
+Usage: python -m benchmarks.bench_website_extraction [path/to/html] [--repeat N]
+
+Without a directory, a fixed set of article-like pages (navigation,
+scripts, hidden blocks, tables) is generated first, so runs are
+reproducible on any machine.
+"""
+import re
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bs4 import BeautifulSoup, Comment
+from services.website_extraction_service import extract_content_from_html, _tables_to_dataframes, HTML_PARSER
+from services.table_processing import prepare_tables
+
+
+def legacy_extract(html):
+    # The extraction as it was before the single-pass rewrite: html.parser,
+    # a full re-parse for the text copy and one find_all pass per rule
+    soup = BeautifulSoup(html, 'html.parser')
+    tables = prepare_tables(_tables_to_dataframes(soup.find_all('table')))
+
+    soup = BeautifulSoup(str(soup), 'html.parser')
+    for tag in soup.find_all(['script', 'style', 'noscript', 'iframe', 'svg', 'nav', 'footer', 'header',
+                              'aside', 'form', 'button']):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
+        comment.extract()
+    for tag in soup.find_all(attrs={'style': re.compile(r'display\s*:\s*none', re.I)}):
+        tag.decompose()
+    for tag in soup.find_all(attrs={'hidden': True}):
+        tag.decompose()
+    for tag in soup.find_all(attrs={'aria-hidden': 'true'}):
+        tag.decompose()
+
+    main_content = (
+        soup.find('main') or
+        soup.find('article') or
+        soup.find('div', role='main') or
+        soup.find('div', id=re.compile(r'content|main|article|post|entry', re.I)) or
+        soup.find('div', class_=re.compile(r'content|main|article|post|entry', re.I))
+    )
+    source = main_content if main_content else soup.find('body') or soup
+    lines = [line.strip() for line in source.get_text(separator='\n', strip=True).splitlines()]
+    text = re.sub(r'\n{3,}', '\n\n', '\n'.join(line for line in lines if len(line) >= 3)).strip()
+    return {'text': text, 'tables': tables}
+
+
+# (file name, sections, paragraphs per section, tables)
+FIXTURES = [
+    ('small.html', 3, 4, 1),
+    ('medium.html', 20, 6, 4),
+    ('large.html', 120, 8, 12),
+]
+
+
+def _fixture_page(sections, paragraphs, tables):
+    nav = ''.join(f'<li><a href="/section-{i}">Section {i}</a></li>' for i in range(sections))
+    body = []
+    for i in range(sections):
+        body.append(f'<h2>Section {i}</h2>')
+        for j in range(paragraphs):
+            body.append(f'<p>Paragraph {j} of section {i} describes policy item {i * paragraphs + j} '
+                        f'and how it applies to teams in region {j % 5}.</p>')
+        if i % 7 == 3:
+            body.append(f'<div style="display: none"><p>Hidden note {i}</p></div>')
+            body.append(f'<form><button>Subscribe {i}</button></form>')
+    for t in range(tables):
+        rows = ''.join(f'<tr><td>Item {t}-{r}</td><td>{(t * 31 + r * 7) % 100}</td><td>Q{r % 4 + 1}</td></tr>'
+                       for r in range(12))
+        body.insert((t * 5) % len(body), f'<table><tr><th>Name</th><th>Value</th><th>Quarter</th></tr>{rows}</table>')
+    return (f'<!DOCTYPE html><html><head><title>Fixture</title><style>p {{ margin: 0 }}</style>'
+            f'<script>var tracking = {sections};</script></head><body>'
+            f'<header><nav><ul>{nav}</ul></nav></header>'
+            f'<main><article>{"".join(body)}</article></main>'
+            f'<aside>Related links</aside><footer>Footer text</footer></body></html>')
+
+
+def write_fixtures(out_dir):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, sections, paragraphs, tables in FIXTURES:
+        (out_dir / name).write_text(_fixture_page(sections, paragraphs, tables), encoding='utf-8')
+
+
+def _best_time(fn, html, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(html)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(html_dir, repeat):
+    pages = sorted(list(Path(html_dir).glob('*.html')) + list(Path(html_dir).glob('*.htm')))
+    if not pages:
+        print(f"No HTML files found in {html_dir}")
+        return
+
+    print(f"current parser: {HTML_PARSER}\n")
+    print(f"{'file':40} {'KiB':>7} {'legacy (s)':>11} {'current (s)':>12} {'speedup':>8} {'text match':>11}")
+    legacy_total = current_total = 0.0
+    for page in pages:
+        html = page.read_text(encoding='utf-8', errors='replace')
+        legacy_time, legacy = _best_time(legacy_extract, html, repeat)
+        current_time, current = _best_time(extract_content_from_html, html, repeat)
+        legacy_total += legacy_time
+        current_total += current_time
+        print(f"{page.name[:40]:40} {len(html) / 1024:>7.0f} {legacy_time:>11.4f} {current_time:>12.4f} "
+              f"{legacy_time / current_time:>7.1f}x {str(legacy['text'] == current['text']):>11}")
+
+    print()
+    print(f"total best time: legacy {legacy_total:.3f}s, current {current_total:.3f}s "
+          f"({legacy_total / current_total:.1f}x) over {len(pages)} pages")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('html_dir', nargs='?')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if args.html_dir:
+        run(args.html_dir, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as fixture_dir:
+            write_fixtures(fixture_dir)
+            run(fixture_dir, args.repeat)
@@ -1,10 +1,11 @@
 import streamlit as st
 import pandas as pd
-import json
 import os
+from pathlib import Path
 from datetime import datetime, timedelta
 import plotly.express as px
-from huggingface_hub import hf_hub_download
+from huggingface_hub import snapshot_download
+from services.log_entries import read_jsonl, merge_entries
 
 # Page configuration
 st.set_page_config(
@@ -33,23 +34,28 @@ HF_REPO = "aniketp2009gmail/omnidoc-qa-logs"
 COST_PER_1K_TOKENS = 0.0001  # Example pricing
 
 def load_data():
+    # Logs are shipped as segment files; the single legacy file predates that
     try:
-        log_path = hf_hub_download(
+        local_dir = snapshot_download(
             repo_id=HF_REPO,
-            filename="rag_requests.jsonl",
             repo_type="dataset",
+            allow_patterns=["rag_requests.jsonl", "segments/*.jsonl"],
             token=os.getenv("HF_TOKEN"),
         )
     except Exception:
         return pd.DataFrame()
 
-    data = []
-    with open(log_path, 'r') as f:
-        for line in f:
-            try:
-                data.append(json.loads(line))
-            except Exception:
-                continue
+    paths = sorted(Path(local_dir).glob("segments/*.jsonl"))
+    legacy_path = Path(local_dir) / "rag_requests.jsonl"
+    if legacy_path.exists():
+        paths.insert(0, legacy_path)
+
+    entries = []
+    for path in paths:
+        entries.extend(read_jsonl(path))
+
+    # Fold feedback events into their request rows
+    data = merge_entries(entries)
 
     if not data:
         return pd.DataFrame()
@@ -129,6 +135,14 @@ elif page == "Performance":
     col2.metric("p95 Latency", f"{p95:.2f}s")
     col3.metric("p99 Latency", f"{p99:.2f}s")
 
+    # Time-to-first-token is only recorded for streamed answers
+    if 'ttft' in df.columns and df['ttft'].notnull().any():
+        ttft = df['ttft'].dropna()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("p50 Time to First Token", f"{ttft.quantile(0.5):.2f}s")
+        col2.metric("p95 Time to First Token", f"{ttft.quantile(0.95):.2f}s")
+        col3.metric("Streamed Requests", f"{len(ttft)}")
+
     st.subheader("Latency Distribution")
     fig = px.histogram(df, x='latency', nbins=30, template="plotly_dark", color_discrete_sequence=['#00d4ff'])
     st.plotly_chart(fig, use_container_width=True)
@@ -147,6 +161,26 @@ elif page == "Usage":
     col1.metric("Total Tokens", f"{total_tokens:,}")
     col2.metric("Estimated Cost", f"${estimated_cost:.4f}")
 
+    # Prompt tokens the context builder trimmed (overlap, duplicates, budget)
+    if 'context_tokens_saved' in df.columns:
+        saved = df['context_tokens_saved'].fillna(0)
+        col1, col2 = st.columns(2)
+        col1.metric("Context Tokens Saved", f"{int(saved.sum()):,}")
+        col2.metric("Avg Saved per Query", f"{saved.mean():.0f}")
+
+    # Answers served from the semantic answer cache cost no Groq tokens
+    if 'cache_hit' in df.columns:
+        cache_hits = df['cache_hit'].fillna(False).astype(bool)
+        col1, col2 = st.columns(2)
+        col1.metric("Answer Cache Hit Rate", f"{cache_hits.mean() * 100:.1f}%")
+        col2.metric("Cached Answers", f"{cache_hits.sum():,}")
+
+        hit_rate_df = df.assign(cache_hit=cache_hits).groupby(pd.Grouper(key='datetime', freq='1h'))['cache_hit'].mean().dropna().reset_index()
+        if not hit_rate_df.empty:
+            st.subheader("Answer Cache Hit Rate Over Time")
+            fig = px.line(hit_rate_df, x='datetime', y='cache_hit', template="plotly_dark")
+            st.plotly_chart(fig, use_container_width=True)
+
     st.subheader("Token Usage Over Time")
     usage_df = df.groupby(pd.Grouper(key='datetime', freq='1h'))[['tokens_input', 'tokens_output']].sum().dropna(how='all').reset_index()
     if not usage_df.empty:
@@ -164,13 +198,43 @@ elif page == "Retrieval Quality":
     st.title("🎯 Retrieval Quality")
 
     col1, col2 = st.columns(2)
-    avg_chunks = df['chunks_retrieved'].mean()
+    # Cache hits skip retrieval, so they are left out of the chunk stats
+    retrieved_df = df[~df['cache_hit'].fillna(False).astype(bool)] if 'cache_hit' in df.columns else df
+    avg_chunks = retrieved_df['chunks_retrieved'].mean()
     col1.metric("Avg Chunks Retrieved", f"{avg_chunks:.1f}")
 
-    st.subheader("Chunks Retrieved Distribution")
-    fig = px.box(df, y='chunks_retrieved', template="plotly_dark")
+    # Chunks left after the context builder merged, deduplicated and trimmed
+    # them to the token budget, i.e. what was actually sent to the LLM
+    chunk_columns = ['chunks_retrieved']
+    if 'chunks_used' in retrieved_df.columns and retrieved_df['chunks_used'].notnull().any():
+        col1.metric("Avg Chunks Sent to LLM", f"{retrieved_df['chunks_used'].mean():.1f}")
+        chunk_columns.append('chunks_used')
+
+    st.subheader("Chunks Retrieved vs. Sent Distribution")
+    fig = px.box(retrieved_df, y=chunk_columns, template="plotly_dark")
     st.plotly_chart(fig, use_container_width=True)
 
+    # Adaptive k: chosen k and dense similarity scores, for tuning the
+    # cutoff, elbow gap and no-context thresholds
+    if 'chosen_k' in df.columns and df['chosen_k'].notnull().any():
+        policy_df = df[df['chosen_k'].notnull()]
+        no_context_rate = (policy_df['chosen_k'] == 0).mean() * 100
+        col2.metric("Answered Without Context", f"{no_context_rate:.1f}%")
+
+        st.subheader("Chosen k Distribution")
+        fig = px.histogram(policy_df, x='chosen_k', template="plotly_dark", color_discrete_sequence=['#00d4ff'])
+        st.plotly_chart(fig, use_container_width=True)
+
+        scores = policy_df['retrieval_scores'].dropna()
+        score_df = pd.DataFrame({
+            'top_score': scores.map(lambda s: s[0] if s else None),
+            'kth_score': [s[min(int(k), len(s)) - 1] if s and k else None for s, k in zip(scores, policy_df.loc[scores.index, 'chosen_k'])],
+        }).dropna(how='all')
+        if not score_df.empty:
+            st.subheader("Similarity Scores (best hit vs. last chunk used)")
+            fig = px.histogram(score_df, x=['top_score', 'kth_score'], barmode='overlay', nbins=40, template="plotly_dark")
+            st.plotly_chart(fig, use_container_width=True)
+
     st.subheader("Top Queries")
     top_queries = df['query'].value_counts().head(10)
     st.bar_chart(top_queries)
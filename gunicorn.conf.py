@@ -0,0 +1,43 @@
+import os
+import multiprocessing
+
+# Production serving: gunicorn -c gunicorn.conf.py app:app
+#
+# The app (and the embedding model) is imported once in the master and the
+# workers are forked from it, so the model weights are shared copy-on-write.
+# Connections (Chroma, SQLite) are opened by each worker after the fork.
+# Several workers need state they can all reach: vectors in a Chroma server
+# (CHROMA_HOST) and sessions, jobs and the document registry in a SQLite file
+# (STATE_DB). Without a Chroma server every worker would hold its own
+# index, so a single worker is used.
+
+cores = multiprocessing.cpu_count()
+
+if os.getenv('CHROMA_HOST'):
+    workers = int(os.getenv('WEB_CONCURRENCY', cores))
+    os.environ.setdefault('STATE_DB', '/tmp/omnidoc-state.db')
+else:
+    workers = 1
+    if int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+        print("WEB_CONCURRENCY ignored: set CHROMA_HOST to share the vector store between workers")
+
+# Threads serve concurrent requests inside a worker while it waits on Groq,
+# Chroma or a streamed answer
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# Split the cores between the workers' embedding threads instead of letting
+# every worker's torch use all of them
+os.environ.setdefault('EMBED_THREADS', str(max(1, cores // workers)))
+
+bind = f"0.0.0.0:{os.getenv('PORT', 7860)}"
+preload_app = True
+
+# Answers are streamed and ingestion runs in background jobs, so requests
+# only need a generous limit for slow LLM calls
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,123 @@
+import os
+import re
+import math
+import threading
+from collections import Counter
+
+BM25_K1 = float(os.getenv('BM25_K1', 1.5))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+
+# Identifiers like "AB-1234" or "v2.1.0" are kept whole and also split into
+# their parts, so both the exact identifier and its pieces match
+_TOKEN_RE = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+_SEPARATOR_RE = re.compile(r'[-_./]')
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if _SEPARATOR_RE.search(token):
+            tokens.extend(_SEPARATOR_RE.split(token))
+    return tokens
+
+
+class BM25Index:
+    """In-process inverted index over the stored chunks, scored with BM25.
+
+    Chunks are added and removed together with their vectors, keyed by the
+    same chunk ID and grouped by document ID (the chunk's 'source').
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._terms = {}
+        self._lengths = {}
+        self._sources = {}
+        self._chunks_by_source = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, chunk_id, text, source):
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if chunk_id in self._lengths:
+                return
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[chunk_id] = tf
+            self._terms[chunk_id] = tuple(counts)
+            length = sum(counts.values())
+            self._lengths[chunk_id] = length
+            self._total_length += length
+            self._sources[chunk_id] = source
+            self._chunks_by_source.setdefault(source, set()).add(chunk_id)
+
+    def add_many(self, chunks):
+        # chunks: iterable of (chunk_id, text, source)
+        for chunk_id, text, source in chunks:
+            self.add(chunk_id, text, source)
+
+    def _remove_chunk(self, chunk_id):
+        for term in self._terms.pop(chunk_id):
+            postings = self._postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id)
+        return self._sources.pop(chunk_id)
+
+    def remove_source(self, source):
+        with self._lock:
+            for chunk_id in self._chunks_by_source.pop(source, ()):
+                self._remove_chunk(chunk_id)
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id not in self._lengths:
+                    continue
+                source = self._remove_chunk(chunk_id)
+                chunks = self._chunks_by_source.get(source)
+                if chunks is not None:
+                    chunks.discard(chunk_id)
+                    if not chunks:
+                        del self._chunks_by_source[source]
+
+    def search(self, query, k, sources=None):
+        """Return up to k (chunk_id, score) pairs, best first.
+
+        sources restricts scoring to chunks of those document IDs.
+        """
+        terms = set(tokenize(query))
+        allowed = set(sources) if sources is not None else None
+        with self._lock:
+            n = len(self._lengths)
+            if not n or not terms:
+                return []
+            avg_length = self._total_length / n
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    if allowed is not None and self._sources[chunk_id] not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked lists of IDs; each list adds 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,133 @@
+import os
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Characters per chunk by document type. Table summaries are split between
+# rows (blank-line or line separated records) and without overlap, so a row
+# is never repeated or cut unless it is longer than a whole chunk.
+CHUNK_SIZES = {
+    'PDF': int(os.getenv('PDF_CHUNK_SIZE', 500)),
+    'Website': int(os.getenv('WEB_CHUNK_SIZE', 500)),
+    'Table': int(os.getenv('TABLE_CHUNK_SIZE', 500)),
+}
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 50))
+
+# A heading that can't be found in the text is skipped after this many
+# later headings have been tried for the same line
+HEADING_LOOKAHEAD = 5
+SECTION_SEPARATOR = ' > '
+
+SECTION_METADATA = ('page', 'section', 'url')
+
+_splitters = {}
+
+
+def _normalize(line):
+    return ' '.join(line.split()).lower()
+
+
+def _heading_key(title):
+    # Extracted text puts inline children of a heading on separate lines;
+    # the heading is found by its first line
+    lines = [line for line in title.splitlines() if line.strip()]
+    return _normalize(lines[0]) if lines else ''
+
+
+class HeadingPath:
+    """The headings enclosing the current position, outermost first."""
+
+    def __init__(self):
+        self._stack = []
+
+    def push(self, level, title):
+        while self._stack and self._stack[-1][0] >= level:
+            self._stack.pop()
+        self._stack.append((level, ' '.join(title.split())))
+
+    def __str__(self):
+        return SECTION_SEPARATOR.join(title for _, title in self._stack)
+
+
+def split_sections(text, headings, path=None, offset=0, apply_unmatched=False, **metadata):
+    """Cut text into sections that start at its headings.
+
+    headings are (level, title) pairs in document order, matched against
+    whole lines of text. Each section carries its text, the character
+    offset of its start (counted from offset), its heading path and the
+    extra metadata. path carries the heading stack across calls (e.g. from
+    page to page). With apply_unmatched, headings that aren't found in the
+    text still take effect, as PDF outline entries for a page should.
+    """
+    path = path if path is not None else HeadingPath()
+
+    # Position of each matched heading; with apply_unmatched, a heading that
+    # isn't found takes effect right after the previous one (or at the start)
+    positions = {}
+    next_heading = 0
+    position = 0
+    for line in text.split('\n'):
+        key = _normalize(line)
+        if key:
+            for j in range(next_heading, min(next_heading + HEADING_LOOKAHEAD, len(headings))):
+                if _heading_key(headings[j][1]) == key:
+                    positions[j] = position
+                    next_heading = j + 1
+                    break
+        position += len(line) + 1
+
+    events = []
+    last = 0
+    for j, heading in enumerate(headings):
+        if j in positions:
+            last = positions[j]
+        elif not apply_unmatched:
+            continue
+        events.append((last, heading))
+
+    sections = []
+
+    def add(start, end):
+        if text[start:end].strip():
+            sections.append({'text': text[start:end], 'start': offset + start, 'section': str(path), **metadata})
+
+    start = 0
+    for position, heading in events:
+        if position > start:
+            add(start, position)
+            start = position
+        path.push(*heading)
+    add(start, len(text))
+    return sections
+
+
+def _get_splitter(doc_type):
+    if doc_type not in _splitters:
+        size = CHUNK_SIZES.get(doc_type, CHUNK_SIZES['Website'])
+        overlap = 0 if doc_type == 'Table' else min(CHUNK_OVERLAP, size // 2)
+        _splitters[doc_type] = RecursiveCharacterTextSplitter(
+            chunk_size=size, chunk_overlap=overlap, add_start_index=True)
+    return _splitters[doc_type]
+
+
+def chunk_sections(sections, doc_type='Website'):
+    """Split sections into (text, metadata) chunks that never cross a section.
+
+    Sections are plain strings or dicts from split_sections. The metadata
+    holds the chunk's page, section path and URL when known, and its
+    'start_index' / 'end_index' character offsets when the section's start
+    is known.
+    """
+    splitter = _get_splitter(doc_type)
+    chunks = []
+    for section in sections:
+        if isinstance(section, str):
+            section = {'text': section}
+        base = {key: section[key] for key in SECTION_METADATA if section.get(key) not in (None, '')}
+        start = section.get('start')
+        for doc in splitter.create_documents([section['text']]):
+            metadata = dict(base)
+            local_start = doc.metadata.get('start_index', -1)
+            if start is not None and local_start >= 0:
+                metadata['start_index'] = start + local_start
+                metadata['end_index'] = metadata['start_index'] + len(doc.page_content)
+            chunks.append((doc.page_content, metadata))
+    return chunks
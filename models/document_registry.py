@@ -0,0 +1,164 @@
+import json
+import hashlib
+from pathlib import Path
+from models.state_store import MemoryStore, SQLiteStore
+
+REGISTRY_DB = 'document_registry.db'
+# Registry file of earlier versions, imported into REGISTRY_DB once
+REGISTRY_FILE = 'document_registry.json'
+
+
+def fingerprint_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TextFingerprint:
+    """Incremental fingerprint_text() for text that arrives in pieces."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._empty = True
+
+    def update(self, text):
+        # Whitespace differences between extractions should not defeat dedup
+        normalized = ' '.join(text.split()).lower()
+        if not normalized:
+            return
+        if not self._empty:
+            self._hash.update(b' ')
+        self._hash.update(normalized.encode('utf-8'))
+        self._empty = False
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def fingerprint_text(text):
+    fingerprint = TextFingerprint()
+    fingerprint.update(text)
+    return fingerprint.hexdigest()
+
+
+class DocumentRegistry:
+    """Maps upload fingerprints to ingested document IDs and ref-counts them.
+
+    Sessions that upload the same document share one chunk set. Vectors
+    should only be dropped when ``release`` reports the last reference.
+    With a shared state store (several worker processes), documents and
+    references live in it. Otherwise references are per process, and with
+    a persist directory documents are kept in a SQLite file next to the
+    vector index, so after a restart documents kept in a persistent vector
+    store can still be attached by reference. Every change to a document
+    bumps its version, which other workers use to notice the change.
+    """
+
+    def __init__(self, persist_directory=None, store=None):
+        self._refs = store or MemoryStore()
+        if store is not None:
+            self._store = store
+        elif persist_directory:
+            self._store = SQLiteStore(str(Path(persist_directory) / REGISTRY_DB))
+            self._import_json(Path(persist_directory) / REGISTRY_FILE)
+        else:
+            self._store = MemoryStore()
+
+    def _import_json(self, path):
+        # Registries written before the SQLite store are imported once
+        if not path.exists() or self._store.items('documents'):
+            return
+        with open(path, 'r') as f:
+            stored = json.load(f)
+        with self._store.transaction():
+            for fingerprint, doc_id in stored.get('fingerprints', {}).items():
+                self._store.put('fingerprints', fingerprint, doc_id)
+            for doc_id, document in stored.get('documents', {}).items():
+                self._store.put('documents', doc_id, {**document, 'version': 1})
+
+    def lookup(self, fingerprint):
+        return self._store.get('fingerprints', fingerprint)
+
+    def register(self, doc_id, fingerprints, **info):
+        with self._store.transaction():
+            document = self._store.get('documents', doc_id) or {'fingerprints': [], 'version': 0}
+            document.update(info)
+            for fingerprint in fingerprints:
+                if fingerprint and fingerprint not in document['fingerprints']:
+                    self._store.put('fingerprints', fingerprint, doc_id)
+                    document['fingerprints'].append(fingerprint)
+            document['version'] += 1
+            self._store.put('documents', doc_id, document)
+
+    def update(self, doc_id, fingerprints, **info):
+        """Replace a document's fingerprints after its content was refreshed.
+
+        Fingerprints already held by another document stay with it.
+        """
+        with self._store.transaction():
+            document = self._store.get('documents', doc_id) or {'fingerprints': [], 'version': 0}
+            for fingerprint in document['fingerprints']:
+                if self._store.get('fingerprints', fingerprint) == doc_id:
+                    self._store.delete('fingerprints', fingerprint)
+            document['fingerprints'] = []
+            document.update(info)
+            for fingerprint in fingerprints:
+                if fingerprint and self._store.get('fingerprints', fingerprint) in (None, doc_id) \
+                        and fingerprint not in document['fingerprints']:
+                    self._store.put('fingerprints', fingerprint, doc_id)
+                    document['fingerprints'].append(fingerprint)
+            document['version'] += 1
+            self._store.put('documents', doc_id, document)
+
+    def get(self, doc_id):
+        return self._store.get('documents', doc_id)
+
+    def versions(self, doc_ids):
+        """Current version of each document; None for documents that are gone."""
+        versions = {}
+        for doc_id in doc_ids:
+            document = self._store.get('documents', doc_id)
+            versions[doc_id] = document['version'] if document else None
+        return versions
+
+    def acquire(self, doc_id):
+        with self._refs.transaction():
+            refs = (self._refs.get('refs', doc_id) or 0) + 1
+            self._refs.put('refs', doc_id, refs)
+            return refs
+
+    def acquire_fingerprint(self, fingerprint):
+        """Take a reference to the document holding fingerprint, if any.
+
+        The lookup and the reference are one transaction, so a concurrent
+        last release can't drop the document in between. Returns its ID,
+        or None when no document has the fingerprint.
+        """
+        with self._refs.transaction(), self._store.transaction():
+            doc_id = self._store.get('fingerprints', fingerprint)
+            if doc_id is None:
+                return None
+            self._refs.put('refs', doc_id, (self._refs.get('refs', doc_id) or 0) + 1)
+            return doc_id
+
+    def release(self, doc_id):
+        """Drop one reference. Returns True when it was the last one."""
+        with self._refs.transaction(), self._store.transaction():
+            refs = (self._refs.get('refs', doc_id) or 0) - 1
+            if refs > 0:
+                self._refs.put('refs', doc_id, refs)
+                return False
+
+            self._refs.delete('refs', doc_id)
+            document = self._store.get('documents', doc_id)
+            if document:
+                for fingerprint in document['fingerprints']:
+                    if self._store.get('fingerprints', fingerprint) == doc_id:
+                        self._store.delete('fingerprints', fingerprint)
+                self._store.delete('documents', doc_id)
+            return True
+
+    def chunk_count(self, doc_id):
+        document = self._store.get('documents', doc_id)
+        return document.get('chunks', 0) if document else 0
+
+    def refs(self, doc_id):
+        return self._refs.get('refs', doc_id) or 0
@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process, the thread lock is enough
+    fcntl = None
+
+EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', 50000))
+
+# Set to a directory to keep embeddings on disk across restarts
+EMBED_CACHE_DIR = os.getenv('EMBED_CACHE_DIR')
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache keyed by hash(model name, text).
+
+    The first tier is an in-process LRU. The optional disk tier is an
+    append-only float32 matrix (read through a memory map) plus a key file
+    whose line number is the row index. Several processes (server workers)
+    can share the disk tier: appends are serialized by a file lock, and rows
+    added by other processes are picked up from the key file.
+    """
+
+    def __init__(self, model_name, max_entries=EMBED_CACHE_SIZE, cache_dir=EMBED_CACHE_DIR):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        self._disk_dir = None
+        self._disk_index = {}
+        self._disk_rows = 0
+        self._keys_offset = 0
+        self._disk_dim = None
+        self._disk_matrix = None
+        if cache_dir:
+            model_key = hashlib.sha256(model_name.encode('utf-8')).hexdigest()[:16]
+            self._disk_dir = Path(cache_dir) / model_key
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def _disk_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._disk_dir / 'disk.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_disk_index(self):
+        with self._disk_lock():
+            self._sync_disk_index()
+            # Vectors are written before their key, so a crash between the two
+            # leaves trailing rows without a key: drop them so new rows line up
+            # with new keys
+            vectors_path = self._disk_dir / 'vectors.f32'
+            if self._disk_dim and vectors_path.exists() \
+                    and vectors_path.stat().st_size > self._disk_rows * self._disk_dim * 4:
+                with open(vectors_path, 'r+b') as f:
+                    f.truncate(self._disk_rows * self._disk_dim * 4)
+
+    def _sync_disk_index(self):
+        # Reads keys appended (by this or another process) since the last
+        # call. A key is only written after its vector, so every complete
+        # line has its row in the matrix.
+        keys_path = self._disk_dir / 'keys.txt'
+        if self._disk_dim is None:
+            meta_path = self._disk_dir / 'meta.json'
+            if not meta_path.exists():
+                return
+            with open(meta_path, 'r') as f:
+                self._disk_dim = json.load(f)['dim']
+        if not keys_path.exists() or keys_path.stat().st_size == self._keys_offset:
+            return
+        with open(keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self._disk_index.setdefault(line.decode('utf-8').strip(), self._disk_rows)
+                self._disk_rows += 1
+                self._keys_offset += len(line)
+
+    def _disk_get(self, key):
+        row = self._disk_index.get(key)
+        if row is None:
+            return None
+        if self._disk_matrix is None or row >= self._disk_matrix.shape[0]:
+            self._disk_matrix = np.memmap(
+                self._disk_dir / 'vectors.f32', dtype=np.float32, mode='r',
+                shape=(self._disk_rows, self._disk_dim),
+            )
+        return self._disk_matrix[row].tolist()
+
+    def _disk_put(self, items):
+        with self._disk_lock():
+            self._sync_disk_index()
+            if self._disk_dim is None:
+                self._disk_dim = len(items[0][1])
+                with open(self._disk_dir / 'meta.json', 'w') as f:
+                    json.dump({'model': self.model_name, 'dim': self._disk_dim}, f)
+
+            items = list({key: vector for key, vector in items if key not in self._disk_index}.items())
+            if not items:
+                return
+            # New rows go right after the last row with a key, whichever
+            # process wrote it
+            matrix = np.asarray([vector for _, vector in items], dtype=np.float32)
+            with open(self._disk_dir / 'vectors.f32', 'ab') as f:
+                f.truncate(self._disk_rows * self._disk_dim * 4)
+                f.write(matrix.tobytes())
+            with open(self._disk_dir / 'keys.txt', 'a') as f:
+                f.truncate(self._keys_offset)
+                for key, _ in items:
+                    f.write(key + '\n')
+            self._sync_disk_index()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Return cached vectors for keys, with None for misses."""
+        results = []
+        with self._lock:
+            if self._disk_dir is not None:
+                self._sync_disk_index()
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    results.append(vector)
+                    continue
+
+                if self._disk_dir is not None:
+                    vector = self._disk_get(key)
+                if vector is not None:
+                    self._remember(key, vector)
+                    self._stats['disk_hits'] += 1
+                else:
+                    self._stats['misses'] += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, items):
+        if not items:
+            return
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            if self._disk_dir is not None:
+                self._disk_put(items)
+
+    def stats(self):
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['disk_hits']
+            total = hits + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round(hits / total, 4) if total else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._disk_index),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model on cache misses."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Embed each distinct missing text once, even if it repeats in the batch
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing, embedded))
+            self.cache.put_many(list(fresh.items()))
+            vectors = [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,102 @@
+import os
+import time
+import itertools
+import threading
+from queue import PriorityQueue
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+
+# Texts per model call, and torch intra-op threads for the embedding thread
+# (0 keeps torch's default of one thread per core)
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64))
+EMBED_THREADS = int(os.getenv('EMBED_THREADS', 0))
+
+QUERY_PRIORITY = 0
+BULK_PRIORITY = 1
+
+
+class EmbeddingExecutor(Embeddings):
+    """Runs every model call on one dedicated thread, queries first.
+
+    Bulk embedding is cut into batches of batch_size, each queued as its
+    own task, so a query embedding waits for at most one batch instead of
+    a whole document.
+    """
+
+    def __init__(self, embeddings, batch_size=EMBED_BATCH_SIZE, threads=EMBED_THREADS):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.threads = threads
+        self._queue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._stats = {'queries': 0, 'chunks': 0, 'batches': 0, 'bulk_seconds': 0.0}
+        # A forked child (e.g. a preloaded server's worker) starts with a
+        # fresh queue and lock; the parent's worker thread doesn't exist there
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._queue = PriorityQueue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _ensure_worker(self):
+        # Started lazily so that forked processes get their own worker thread
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='embedding-executor', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        if self.threads > 0:
+            try:
+                import torch
+                torch.set_num_threads(self.threads)
+            except ImportError:
+                pass
+
+        while True:
+            _, _, fn, args, future, kind = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.time()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            with self._lock:
+                if kind == 'query':
+                    self._stats['queries'] += 1
+                else:
+                    self._stats['chunks'] += len(args[0])
+                    self._stats['batches'] += 1
+                    self._stats['bulk_seconds'] += time.time() - start
+            future.set_result(result)
+
+    def _submit(self, priority, kind, fn, *args):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((priority, next(self._sequence), fn, args, future, kind))
+        return future
+
+    def embed_documents(self, texts):
+        futures = [
+            self._submit(BULK_PRIORITY, 'bulk', self.embeddings.embed_documents, texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text):
+        return self._submit(QUERY_PRIORITY, 'query', self.embeddings.embed_query, text).result()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['batch_size'] = self.batch_size
+        stats['chunks_per_sec'] = round(stats['chunks'] / stats['bulk_seconds'], 1) if stats['bulk_seconds'] else 0.0
+        stats['bulk_seconds'] = round(stats['bulk_seconds'], 2)
+        return stats
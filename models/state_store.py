@@ -0,0 +1,130 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Set to a SQLite file to share sessions, ingestion job status and the
+# document registry between worker processes; without it, state lives in
+# the process (fine for a single worker)
+STATE_DB = os.getenv('STATE_DB')
+
+# Seconds a write waits for another process's transaction to finish
+STATE_DB_TIMEOUT = float(os.getenv('STATE_DB_TIMEOUT', 30))
+
+
+class MemoryStore:
+    """Process-local state store.
+
+    Values are stored as JSON, like SQLiteStore, so callers never share
+    mutable objects with the store and behave the same with either backend.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield
+
+    def get(self, table, key):
+        with self._lock:
+            value = self._tables.get(table, {}).get(key)
+        return json.loads(value) if value is not None else None
+
+    def put(self, table, key, value):
+        value = json.dumps(value)
+        with self._lock:
+            self._tables.setdefault(table, {})[key] = value
+
+    def delete(self, table, key):
+        with self._lock:
+            return self._tables.get(table, {}).pop(key, None) is not None
+
+    def items(self, table):
+        with self._lock:
+            rows = list(self._tables.get(table, {}).items())
+        return [(key, json.loads(value)) for key, value in rows]
+
+
+class SQLiteStore:
+    """State store in a SQLite file that every worker process can open.
+
+    Each thread of each process gets its own connection. transaction()
+    takes the write lock up front, so a read-modify-write inside it is
+    atomic across processes; nested transactions join the outer one.
+    """
+
+    def __init__(self, path, timeout=STATE_DB_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction_connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                         "tbl TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (tbl, key))")
+
+    def _connection(self):
+        # Connections are not carried across fork: a child opens its own
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+        return self._local.conn
+
+    @contextmanager
+    def _transaction_connection(self):
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    @contextmanager
+    def transaction(self):
+        with self._transaction_connection():
+            yield
+
+    def get(self, table, key):
+        row = self._connection().execute(
+            "SELECT value FROM state WHERE tbl = ? AND key = ?", (table, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, table, key, value):
+        self._connection().execute(
+            "INSERT INTO state (tbl, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (tbl, key) DO UPDATE SET value = excluded.value",
+            (table, key, json.dumps(value)))
+
+    def delete(self, table, key):
+        return self._connection().execute(
+            "DELETE FROM state WHERE tbl = ? AND key = ?", (table, key)).rowcount > 0
+
+    def items(self, table):
+        rows = self._connection().execute("SELECT key, value FROM state WHERE tbl = ?", (table,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+
+def create_state_store(path=STATE_DB):
+    if path:
+        return SQLiteStore(path)
+    return MemoryStore()
@@ -1,24 +1,279 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
+import chromadb
+from models.embedding_cache import EmbeddingCache, CachedEmbeddings
+from models.bm25_index import BM25Index
+from models.embedding_executor import EmbeddingExecutor, EMBED_BATCH_SIZE
+from models.chunker import chunk_sections
+
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+COLLECTION_NAME = os.getenv('VECTOR_STORE_COLLECTION', 'omnidoc')
+
+# Set to a directory to keep the index on disk across restarts
+VECTOR_STORE_DIR = os.getenv('VECTOR_STORE_DIR')
+MANIFEST_FILE = 'index_manifest.json'
+
+# Set to use a Chroma server that several worker processes share instead of
+# an index inside this process
+CHROMA_HOST = os.getenv('CHROMA_HOST')
+CHROMA_PORT = int(os.getenv('CHROMA_PORT', 8000))
+
+# Chunks embedded and written per pipeline step in add_text_to_rag
+WRITE_BATCH_SIZE = EMBED_BATCH_SIZE * 4
+
+# Chunk IDs per delete call
+DELETE_BATCH = 5000
+
+
+def _chunk_id(custom_id, text):
+    # Deterministic IDs let re-ingestion skip chunks that are already stored
+    return hashlib.sha256(f"{custom_id}\0{text}".encode('utf-8')).hexdigest()
+
 
 class VectorStore:
-    def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
-        self.vector_db = Chroma(embedding_function=self.embeddings)
+    def __init__(self, persist_directory=VECTOR_STORE_DIR, chroma_host=CHROMA_HOST, chroma_port=CHROMA_PORT):
+        # Unit-length vectors: the retrieval policy converts L2 distances to
+        # cosine similarity. All model calls go through one executor thread
+        # that serves query embeddings before bulk ingestion batches.
+        self.embeddings = EmbeddingExecutor(HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            encode_kwargs={'batch_size': EMBED_BATCH_SIZE, 'normalize_embeddings': True},
+        ))
+        self.persist_directory = persist_directory
+        self.chroma_host = chroma_host
+        self.chroma_port = chroma_port
+
+        # Chunks seen before (in any session) are served from the cache
+        self.embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+        self.embedding_function = CachedEmbeddings(self.embeddings, self.embedding_cache)
+
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._pipeline_stats = {'chunks': 0, 'seconds': 0.0}
+
+        if persist_directory and not chroma_host:
+            self._check_manifest(persist_directory)
+
+        # The Chroma client is opened by the process that uses it (see vector_db)
+        self._vector_db = None
+        self._vector_db_pid = None
+        self._vector_db_lock = threading.Lock()
+
+        # The BM25 index lives in memory only and starts empty; chunks are
+        # added as they are written, and the documents a question is scoped
+        # to are loaded from the store by sync_lexical() (stored by an
+        # earlier run or another worker process)
+        self._lexical_index = BM25Index()
+        self._lexical_versions = {}
+
+    @property
+    def vector_db(self):
+        # Opened lazily and again after a fork: a preloading server forks its
+        # workers from the master, and a Chroma client created there (its
+        # in-process engine or its HTTP connections) breaks in the children
+        if self._vector_db_pid != os.getpid():
+            with self._vector_db_lock:
+                if self._vector_db_pid != os.getpid():
+                    self._vector_db = self._open_vector_db()
+                    self._vector_db_pid = os.getpid()
+        return self._vector_db
+
+    def _open_vector_db(self):
+        if self.chroma_host:
+            # The model is recorded on the collection when it is created and
+            # checked by every worker that connects
+            vector_db = Chroma(
+                collection_name=COLLECTION_NAME,
+                embedding_function=self.embedding_function,
+                client=chromadb.HttpClient(host=self.chroma_host, port=self.chroma_port),
+                collection_metadata=self._manifest(),
+            )
+            self._check_stored_manifest(vector_db._collection.metadata or {}, self._manifest(),
+                                        f"{self.chroma_host}/{COLLECTION_NAME}")
+            return vector_db
+        if self.persist_directory:
+            # Chroma's persistent client keeps the collection in SQLite plus
+            # HNSW segment files and only loads the index when it is queried
+            return Chroma(
+                collection_name=COLLECTION_NAME,
+                embedding_function=self.embedding_function,
+                persist_directory=self.persist_directory,
+            )
+        return Chroma(embedding_function=self.embedding_function)
+
+    @property
+    def lexical_index(self):
+        return self._lexical_index
+
+    def sync_lexical(self, versions):
+        """Reload documents whose version differs from the one indexed here.
 
-    def add_text_to_rag(self, text, custom_id):
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        texts = text_splitter.split_text(text)
+        versions maps document IDs to their registry version (None when the
+        document is gone). Other worker processes may have added, refreshed
+        or deleted them in the shared store.
+        """
+        index = self.lexical_index
+        for custom_id, version in versions.items():
+            if self._lexical_versions.get(custom_id) == version:
+                continue
+            index.remove_source(custom_id)
+            if version is not None:
+                stored = self.vector_db.get(where={'source': {'$eq': custom_id}}, include=['documents'])
+                index.add_many((chunk_id, text, custom_id) for chunk_id, text in zip(stored['ids'], stored['documents']))
+            self._lexical_versions[custom_id] = version
 
-        documents = []
-        for text_chunk in texts:
-            doc = Document(page_content=text_chunk, metadata={'source': custom_id})
-            documents.append(doc)
+    def _embedding_dim(self):
+        # Read from the model config when possible, so that no inference runs
+        # before a preloading server forks its workers
+        client = getattr(self.embeddings.embeddings, '_client', None)
+        if client is not None and hasattr(client, 'get_sentence_embedding_dimension'):
+            return client.get_sentence_embedding_dimension()
+        return len(self.embeddings.embed_query("dimension probe"))
 
-        self.vector_db.add_documents(documents)
+    def _manifest(self):
+        return {'embedding_model': EMBEDDING_MODEL, 'embedding_dim': self._embedding_dim()}
 
+    def _check_stored_manifest(self, stored, manifest, location):
+        # Vectors from a different embedding model are meaningless to this one,
+        # so refuse to open an index that was built with another model
+        if (stored.get('embedding_model') != manifest['embedding_model']
+                or stored.get('embedding_dim') != manifest['embedding_dim']):
+            raise ValueError(
+                f"Vector store at {location} was built with "
+                f"{stored.get('embedding_model')} ({stored.get('embedding_dim')}d), "
+                f"but {manifest['embedding_model']} ({manifest['embedding_dim']}d) is configured."
+            )
+
+    def _check_manifest(self, persist_directory):
+        path = Path(persist_directory)
+        path.mkdir(parents=True, exist_ok=True)
+        manifest_path = path / MANIFEST_FILE
+        manifest = self._manifest()
+
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                self._check_stored_manifest(json.load(f), manifest, persist_directory)
+        else:
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f)
+
+    def _get_writer(self):
+        # Created lazily so a forked worker process gets its own thread
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index-writer')
+            return self._writer
+
+    def _write_batch(self, chunk_ids, texts, vectors, metadatas, custom_id):
+        self.vector_db._collection.upsert(
+            ids=chunk_ids,
+            embeddings=vectors,
+            documents=texts,
+            metadatas=metadatas,
+        )
+        self.lexical_index.add_many((chunk_id, text, custom_id) for chunk_id, text in zip(chunk_ids, texts))
+
+    def add_text_to_rag(self, text, custom_id, doc_type='Website', table=None):
+        """Chunk, embed and store text under custom_id.
+
+        text is a string or a list of sections (see models.chunker), chunked
+        with the chunk size for doc_type. Chunks of a table summary carry the
+        table's fingerprint as 'table' metadata. Returns the IDs of all
+        chunks of the text, including those that were already stored.
+        """
+        start = time.time()
+        sections = [text] if isinstance(text, str) else text
+
+        documents = {}
+        for text_chunk, metadata in chunk_sections(sections, 'Table' if table else doc_type):
+            chunk_id = _chunk_id(custom_id, text_chunk)
+            if chunk_id not in documents:
+                metadata['source'] = custom_id
+                if table:
+                    metadata['table'] = table
+                documents[chunk_id] = (text_chunk, metadata)
+
+        if not documents:
+            return []
+
+        # Only embed chunks that are not already in the index. Stored chunks
+        # whose position moved (e.g. text inserted above them on a refresh)
+        # get their metadata updated without being embedded again.
+        existing = self.vector_db.get(ids=list(documents), include=['metadatas'])
+        moved = [chunk_id for chunk_id, metadata in zip(existing['ids'], existing['metadatas'])
+                 if metadata != documents[chunk_id][1]]
+        if moved:
+            self.vector_db._collection.update(ids=moved, metadatas=[documents[chunk_id][1] for chunk_id in moved])
+        stored = set(existing['ids'])
+        new_ids = [chunk_id for chunk_id in documents if chunk_id not in stored]
+        if not new_ids:
+            return list(documents)
+
+        # Pipelined: while one batch is written to the index on the writer
+        # thread, the next batch is being embedded
+        pending = None
+        try:
+            for i in range(0, len(new_ids), WRITE_BATCH_SIZE):
+                batch_ids = new_ids[i:i + WRITE_BATCH_SIZE]
+                texts = [documents[chunk_id][0] for chunk_id in batch_ids]
+                metadatas = [documents[chunk_id][1] for chunk_id in batch_ids]
+                vectors = self.embedding_function.embed_documents(texts)
+                if pending is not None:
+                    pending.result()
+                pending = self._get_writer().submit(self._write_batch, batch_ids, texts, vectors, metadatas,
+                                                    custom_id)
+        finally:
+            if pending is not None:
+                pending.result()
+
+        with self._writer_lock:
+            self._pipeline_stats['chunks'] += len(new_ids)
+            self._pipeline_stats['seconds'] += time.time() - start
+        return list(documents)
+
+    def embedding_stats(self):
+        with self._writer_lock:
+            chunks, seconds = self._pipeline_stats['chunks'], self._pipeline_stats['seconds']
+        return {
+            'model': self.embeddings.stats(),
+            'ingested_chunks': chunks,
+            'ingest_chunks_per_sec': round(chunks / seconds, 1) if seconds else 0.0,
+        }
+
+    def count_chunks(self, custom_id):
+        return len(self.vector_db.get(where={'source': {'$eq': custom_id}}, include=[])['ids'])
+
+    def stored_chunks(self, custom_id):
+        """Chunk IDs stored for custom_id, and the IDs per table fingerprint."""
+        stored = self.vector_db.get(where={'source': {'$eq': custom_id}}, include=['metadatas'])
+        tables = {}
+        for chunk_id, metadata in zip(stored['ids'], stored['metadatas']):
+            table = (metadata or {}).get('table')
+            if table:
+                tables.setdefault(table, []).append(chunk_id)
+        return set(stored['ids']), tables
+
+    def delete_chunks(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        for i in range(0, len(chunk_ids), DELETE_BATCH):
+            self.vector_db.delete(ids=chunk_ids[i:i + DELETE_BATCH])
+        self.lexical_index.remove(chunk_ids)
 
     def delete_documents_by_custom_id(self, custom_id):
-        self.vector_db.delete(where={'source': {'$eq': custom_id}})
\ No newline at end of file
+        self.vector_db.delete(where={'source': {'$eq': custom_id}})
+        self.lexical_index.remove_source(custom_id)
+
+    def delete_documents_by_custom_ids(self, custom_ids):
+        # Drops a whole retrieval partition (e.g. a session's documents) at once
+        custom_ids = list(custom_ids)
+        if custom_ids:
+            self.vector_db.delete(where={'source': {'$in': custom_ids}})
+            for custom_id in custom_ids:
+                self.lexical_index.remove_source(custom_id)
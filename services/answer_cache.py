@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1000))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))
+
+# Minimum cosine similarity between question embeddings for a cache hit
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+
+
+class AnswerCache:
+    """Semantic cache of answers keyed by question embedding and document set.
+
+    A lookup only considers entries for exactly the same set of documents,
+    and hits when the cosine similarity to a cached question reaches the
+    threshold. Entries expire after the TTL, the least recently used ones
+    are evicted beyond max_entries, and deleting a document invalidates
+    every entry that used it. version identifies the state of the documents
+    (e.g. their registry versions); an entry stored under another version
+    is stale, which lets each worker process notice changes made by others.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._by_docs = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            group = self._by_docs.get(entry['docs'])
+            if group is not None:
+                group.discard(entry_id)
+                if not group:
+                    del self._by_docs[entry['docs']]
+        return entry
+
+    def lookup(self, question_vector, doc_ids, version=None):
+        docs = frozenset(doc_ids)
+        query = self._normalize(question_vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_docs.get(docs, ())):
+                entry = self._entries[entry_id]
+                if now - entry['created'] > self.ttl or entry['version'] != version:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(query, entry['vector']))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self._stats['hits'] += 1
+            return {**self._entries[best_id]['payload'], 'similarity': round(best_score, 4)}
+
+    def put(self, question_vector, doc_ids, payload, version=None):
+        docs = frozenset(doc_ids)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'vector': self._normalize(question_vector),
+                'docs': docs,
+                'payload': payload,
+                'version': version,
+                'created': time.time(),
+            }
+            self._by_docs.setdefault(docs, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, doc_id):
+        with self._lock:
+            stale = [entry_id for entry_id, entry in self._entries.items() if doc_id in entry['docs']]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self._stats['invalidated'] += len(stale)
+
+    def stats(self):
+        with self._lock:
+            total = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / total, 4) if total else 0.0,
+                'entries': len(self._entries),
+            }
@@ -0,0 +1,153 @@
+import os
+import re
+import math
+
+# Approximate prompt-token budget for the retrieved context, per query type
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+COMPARATIVE_CONTEXT_TOKEN_BUDGET = int(os.getenv('COMPARATIVE_CONTEXT_TOKEN_BUDGET', 3000))
+
+# Chunks whose word sets overlap at least this much are treated as duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.85))
+
+# The splitter repeats up to chunk_overlap (50) characters between
+# neighbouring chunks; shorter common edges are treated as coincidence
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 200
+
+CHARS_PER_TOKEN = 4
+SEPARATOR = "\n\n"
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def estimate_tokens(text):
+    # Llama tokenizers average about four characters per English token;
+    # close enough for budgeting without loading a tokenizer
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _overlap_merge(first, second):
+    # Join second onto first when first ends with the start of second
+    limit = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return None
+
+
+def _offset_merge(first, second):
+    # Chunks carrying their character offset merge when they touch or overlap
+    if first['start'] is None or second['start'] is None or second['start'] < first['start']:
+        return None
+    first_end = first['start'] + len(first['text'])
+    if second['start'] > first_end:
+        return None
+    return first['text'] + second['text'][first_end - second['start']:]
+
+
+def _merge_segments(segments, max_chars):
+    # Merging stops short of max_chars, so a merged segment never has to be
+    # cut down and can't push its best chunk out of the budget
+    merged = True
+    while merged:
+        merged = False
+        for i, first in enumerate(segments):
+            for j, second in enumerate(segments):
+                if i == j or first['scope'] != second['scope']:
+                    continue
+                if first['start'] is not None and second['start'] is not None:
+                    text = _offset_merge(first, second)
+                else:
+                    text = _overlap_merge(first['text'], second['text'])
+                if text is None or len(text) > max_chars:
+                    continue
+                first['text'] = text
+                if second['rank'] < first['rank']:
+                    first['rank'], first['best'] = second['rank'], second['best']
+                first['chunks'] += second['chunks']
+                first['words'] = None
+                segments.pop(j)
+                merged = True
+                break
+            if merged:
+                break
+    return segments
+
+
+def _truncate(segment, max_chars):
+    # Keep a max_chars window around the best-ranked chunk's text, or its
+    # beginning when that chunk alone is over budget
+    text = segment['text']
+    start = max(0, text.find(segment['best']))
+    slack = max(0, max_chars - len(segment['best']))
+    start = max(0, min(start - slack // 2, len(text) - max_chars))
+    segment['text'] = text[start:start + max_chars]
+    segment['chunks'] = [chunk for chunk in segment['chunks'] if chunk in segment['text']] or [segment['best']]
+
+
+def _words(segment):
+    if segment['words'] is None:
+        segment['words'] = set(_WORD_RE.findall(segment['text'].lower()))
+    return segment['words']
+
+
+def _is_near_duplicate(segment, kept):
+    words = _words(segment)
+    for other in kept:
+        other_words = _words(other)
+        union = len(words | other_words)
+        if union and len(words & other_words) / union >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+        if segment['text'] in other['text']:
+            return True
+    return False
+
+
+def build_context(docs, token_budget):
+    """Assemble the prompt context from retrieved docs, best first.
+
+    Overlapping or adjacent chunks of the same source are merged,
+    near-duplicates are dropped and segments are added in relevance order
+    until token_budget is reached. Returns the context, the number of
+    retrieved chunks whose text it contains, its estimated tokens and the
+    tokens saved against joining every chunk.
+    """
+    naive_tokens = estimate_tokens(SEPARATOR.join(doc.page_content for doc in docs))
+
+    segments = [{
+        'text': doc.page_content.strip(),
+        # Offsets count within a document, or within one page of a crawl
+        'scope': (doc.metadata.get('source'), doc.metadata.get('url')),
+        'start': doc.metadata.get('start_index'),
+        'rank': rank,
+        'best': doc.page_content.strip(),
+        'chunks': [doc.page_content.strip()],
+        'words': None,
+    } for rank, doc in enumerate(docs) if doc.page_content.strip()]
+    segments = _merge_segments(segments, token_budget * CHARS_PER_TOKEN)
+    segments.sort(key=lambda segment: segment['rank'])
+
+    kept = []
+    used_tokens = 0
+    for segment in segments:
+        if _is_near_duplicate(segment, kept):
+            continue
+        tokens = estimate_tokens(segment['text'] + SEPARATOR)
+        if used_tokens + tokens > token_budget:
+            if kept:
+                # A smaller, less relevant segment may still fit
+                continue
+            # The best segment alone is over budget
+            _truncate(segment, token_budget * CHARS_PER_TOKEN)
+            tokens = estimate_tokens(segment['text'])
+        kept.append(segment)
+        used_tokens += tokens
+
+    context = SEPARATOR.join(segment['text'] for segment in kept)
+    context_tokens = estimate_tokens(context)
+    return {
+        'context': context,
+        'chunks_used': sum(len(segment['chunks']) for segment in kept),
+        'context_tokens': context_tokens,
+        'tokens_saved': max(0, naive_tokens - context_tokens),
+    }
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+from urllib.parse import urlparse, urljoin
+from urllib.robotparser import RobotFileParser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from services.website_extraction_service import extract_content_from_website, get_session, WEB_TIMEOUT
+
+# Site crawl limits. Pages of one crawl are fetched by a bounded thread
+# pool, and requests to the same host are spaced CRAWL_HOST_DELAY apart.
+CRAWL_MAX_DEPTH = int(os.getenv('CRAWL_MAX_DEPTH', 2))
+CRAWL_MAX_PAGES = int(os.getenv('CRAWL_MAX_PAGES', 50))
+CRAWL_PAGE_LIMIT = int(os.getenv('CRAWL_PAGE_LIMIT', 500))
+CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', 4))
+CRAWL_HOST_DELAY = float(os.getenv('CRAWL_HOST_DELAY', 0.5))
+
+# Links to files that aren't HTML pages are not followed
+SKIPPED_EXTENSIONS = (
+    '.pdf', '.zip', '.gz', '.tar', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.ico',
+    '.css', '.js', '.json', '.xml', '.mp3', '.mp4', '.avi', '.mov', '.woff', '.woff2', '.ttf',
+)
+
+
+def _host(url):
+    host = urlparse(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+class HostThrottle:
+    """Spaces requests to the same host at least delay seconds apart."""
+
+    def __init__(self, delay=CRAWL_HOST_DELAY):
+        self.delay = delay
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RobotsRules:
+    """robots.txt per host, fetched once; unreachable files allow everything."""
+
+    def __init__(self, user_agent='*'):
+        self.user_agent = user_agent
+        self._parsers = {}
+        self._lock = threading.Lock()
+
+    def allowed(self, url):
+        parts = urlparse(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            parser = self._parsers.get(origin)
+        if parser is None:
+            parser = RobotFileParser()
+            try:
+                response = get_session().get(urljoin(origin, '/robots.txt'), timeout=WEB_TIMEOUT)
+                parser.parse(response.text.splitlines() if response.status_code == 200 else [])
+            except Exception:
+                parser.parse([])
+            with self._lock:
+                self._parsers[origin] = parser
+        return parser.can_fetch(self.user_agent, url)
+
+
+def in_scope(url, seed_url, allow_subdomains=False):
+    """Same-domain rule: the seed's host (ignoring 'www.'), or its subdomains."""
+    parts = urlparse(url)
+    if parts.scheme not in ('http', 'https'):
+        return False
+    if parts.path.lower().endswith(SKIPPED_EXTENSIONS):
+        return False
+    host, seed_host = _host(url), _host(seed_url)
+    return host == seed_host or (allow_subdomains and host.endswith('.' + seed_host))
+
+
+def crawl_site(seed_url, on_page, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES,
+               allow_subdomains=False, concurrency=CRAWL_CONCURRENCY, host_delay=CRAWL_HOST_DELAY,
+               respect_robots=True, cancel_event=None):
+    """Breadth-first crawl from seed_url, calling on_page(url, content) as pages arrive.
+
+    content is the dict returned by extract_content_from_website. Pages are
+    fetched concurrently, but on_page always runs in the calling thread, so
+    it can feed a pipeline that isn't thread-safe. Pages that fail to fetch
+    or have no meaningful text are skipped. Returns crawl statistics.
+    """
+    max_pages = max(1, min(max_pages, CRAWL_PAGE_LIMIT))
+    throttle = HostThrottle(host_delay)
+    robots = RobotsRules() if respect_robots else None
+
+    def fetch(url):
+        if robots is not None and not robots.allowed(url):
+            return None
+        throttle.wait(url)
+        return extract_content_from_website(url)
+
+    seen = {seed_url}
+    frontier = [(seed_url, 0)]
+    stats = {'pages': 0, 'failed': 0, 'skipped': 0}
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='crawl')
+    running = {}
+    try:
+        while frontier or running:
+            # Keep the pool busy without scheduling more pages than allowed
+            while frontier and len(running) < concurrency and stats['pages'] + len(running) < max_pages:
+                if cancel_event is not None and cancel_event.is_set():
+                    frontier = []
+                    break
+                url, depth = frontier.pop(0)
+                running[executor.submit(fetch, url)] = (url, depth)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, depth = running.pop(future)
+                try:
+                    content = future.result()
+                except Exception as e:
+                    print(f"Crawl error for {url}: {e}")
+                    stats['failed'] += 1
+                    continue
+                if content is None:
+                    stats['skipped'] += 1
+                    continue
+
+                stats['pages'] += 1
+                on_page(url, content)
+
+                if depth < max_depth:
+                    for link in content.get('links', []):
+                        if link not in seen and in_scope(link, seed_url, allow_subdomains):
+                            seen.add(link)
+                            frontier.append((link, depth + 1))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    stats['discovered'] = len(seen)
+    return stats
@@ -0,0 +1,204 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from models.state_store import MemoryStore
+
+# Heavy ingestion jobs that may run at once; the rest wait in the queue so
+# query latency stays predictable while documents are being ingested
+INGEST_MAX_JOBS = int(os.getenv('INGEST_MAX_JOBS', 2))
+
+# Finished jobs stay pollable for this many seconds
+JOB_RETENTION = int(os.getenv('INGEST_JOB_RETENTION', 3600))
+
+# Running jobs publish their progress to the state store at most this often
+JOB_SYNC_INTERVAL = 0.5
+
+FINISHED = ('completed', 'failed', 'cancelled')
+HOSTNAME = socket.gethostname()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """An ingestion job run by this process, published to the state store."""
+
+    def __init__(self, kind, owner, name, store=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.owner = owner
+        self.name = name
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+        self.cancel_event = threading.Event()
+        self.store = store
+        self._synced = 0.0
+
+    def update(self, stage=None, progress=None):
+        # Also the cooperative cancellation point for the pipeline
+        self.sync(force=stage is not None and stage != self.stage)
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        if stage is not None:
+            self.stage = stage
+        if progress is not None:
+            self.progress = max(self.progress, min(100, int(progress)))
+        self.updated = time.time()
+
+    def sync(self, force=False):
+        # Publish the job's state (throttled) and pick up a cancellation
+        # requested through another worker process
+        if self.store is None:
+            return
+        now = time.time()
+        if not force and now - self._synced < JOB_SYNC_INTERVAL:
+            return
+        self._synced = now
+        with self.store.transaction():
+            record = self.store.get('jobs', self.id)
+            if record and record['cancel']:
+                self.cancel_event.set()
+            self.store.put('jobs', self.id, {
+                'job': self.to_dict(),
+                'owner': self.owner,
+                'cancel': self.cancel_event.is_set(),
+                'host': HOSTNAME,
+                'pid': os.getpid(),
+            })
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'updated': self.updated,
+        }
+
+
+def _process_alive(record):
+    # Jobs of a worker process that exited would otherwise stay 'running'
+    if record['host'] != HOSTNAME:
+        return True
+    try:
+        os.kill(record['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class IngestionJobManager:
+    """Runs ingestion pipelines on a bounded worker pool and tracks progress.
+
+    Jobs run in the process that accepted them; their status lives in the
+    state store, so with a shared store any worker can report or cancel
+    them.
+    """
+
+    def __init__(self, max_workers=INGEST_MAX_JOBS, store=None):
+        self.max_workers = max_workers
+        self.store = store or MemoryStore()
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so a forked worker process gets its own pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ingest')
+            return self._executor
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        with self.store.transaction():
+            for job_id, record in self.store.items('jobs'):
+                if record['job']['status'] in FINISHED and record['job']['updated'] < cutoff:
+                    self.store.delete('jobs', job_id)
+
+    def submit(self, kind, owner, name, fn, *args):
+        """Queue fn(job, *args); its return value becomes the job result."""
+        self._prune()
+        job = Job(kind, owner, name, self.store)
+        job.sync(force=True)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._get_executor().submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        try:
+            job.sync(force=True)
+            if job.cancel_event.is_set():
+                job.status = job.stage = 'cancelled'
+                return
+            job.status = 'running'
+            try:
+                job.result = fn(job, *args)
+                job.status = job.stage = 'completed'
+                job.progress = 100
+            except JobCancelled:
+                job.status = job.stage = 'cancelled'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+        finally:
+            job.updated = time.time()
+            job.sync(force=True)
+            with self._lock:
+                self._jobs.pop(job.id, None)
+
+    def get(self, job_id, owner=None):
+        """The job's state as a dict, or None if it isn't visible to owner."""
+        record = self.store.get('jobs', job_id)
+        if record is None or (owner is not None and record['owner'] != owner):
+            return None
+        job = record['job']
+        if job['status'] not in FINISHED and not _process_alive(record):
+            job.update(status='failed', error='The worker process running this job exited')
+        return job
+
+    def cancel(self, job_id, owner=None):
+        job = self.get(job_id, owner)
+        if job is None or job['status'] in FINISHED:
+            return False
+        with self._lock:
+            local = self._jobs.get(job_id)
+        if local is not None:
+            local.cancel_event.set()
+        # Picked up by the process running the job on its next update
+        with self.store.transaction():
+            record = self.store.get('jobs', job_id)
+            if record is not None:
+                record['cancel'] = True
+                self.store.put('jobs', job_id, record)
+        return True
+
+    def stats(self):
+        counts = {}
+        for _, record in self.store.items('jobs'):
+            status = record['job']['status']
+            if status not in FINISHED and not _process_alive(record):
+                status = 'failed'
+            counts[status] = counts.get(status, 0) + 1
+        return {'max_concurrent': self.max_workers, 'jobs': counts}
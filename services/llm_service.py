@@ -1,10 +1,41 @@
 # LLM
+import os
 import re
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from models.bm25_index import reciprocal_rank_fusion
+from services.context_builder import build_context, CONTEXT_TOKEN_BUDGET, COMPARATIVE_CONTEXT_TOKEN_BUDGET
+from services.retrieval_policy import (choose_k, distance_to_similarity, RETRIEVAL_MIN_SCORE, RETRIEVAL_MIN_K,
+                                      RETRIEVAL_MIN_LEXICAL_SCORE, NO_CONTEXT_ANSWER)
 import time
 
+# Table processing: concurrent Groq calls per document, a time budget per
+# table, and retries with exponential backoff when rate limited
+TABLE_CONCURRENCY = int(os.getenv('TABLE_CONCURRENCY', 4))
+TABLE_TIMEOUT = float(os.getenv('TABLE_TIMEOUT', 60))
+TABLE_MAX_RETRIES = int(os.getenv('TABLE_MAX_RETRIES', 4))
+TABLE_BACKOFF_BASE = 1.0
+
+# Most chunks sent to the LLM; the retrieval policy picks fewer when the
+# similarity scores drop off. Hybrid retrieval recovers exact identifiers and
+# names that dense search misses, so these are smaller than the old
+# dense-only k of 8 and 20. Each retriever contributes HYBRID_CANDIDATES
+# ranked chunks to the reciprocal-rank fusion.
+RETRIEVAL_K = int(os.getenv('RETRIEVAL_K', 5))
+COMPARATIVE_RETRIEVAL_K = int(os.getenv('COMPARATIVE_RETRIEVAL_K', 12))
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 20))
+RRF_K = 60
+
+# Comparative questions over several documents query each document
+# separately, this many at once, so every document gets a share of the
+# COMPARATIVE_RETRIEVAL_K chunk budget
+RETRIEVAL_CONCURRENCY = int(os.getenv('RETRIEVAL_CONCURRENCY', 4))
+
 COMPARATIVE_KEYWORDS = re.compile(
     r'\b(compare|comparison|contrast|difference|differences|differ|versus|vs\.?|'
     r'both|all documents|all files|each document|each file|'
@@ -12,30 +43,82 @@ COMPARATIVE_KEYWORDS = re.compile(
     re.IGNORECASE
 )
 
+class TableTimeoutError(Exception):
+    pass
+
+
+def _is_rate_limited(error):
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status == 429 or 'rate limit' in str(error).lower()
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
 class LLMService:
-    def __init__(self, groq_api_key):
+    # The LLMs can be injected (e.g. local stubs in tests); Groq is the default
+    def __init__(self, groq_api_key, table_checker=None, table_extractor=None, chat=None):
         self.groq_api_key = groq_api_key
 
         self.model = "llama-3.1-8b-instant"
 
-        # Initialize Groq LLM
-        self.Table_Checker = ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=self.model, max_tokens=1)
-        self.Table_Extractor = ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=self.model)
-        self.Chat = ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=self.model)
+        # Initialize Groq LLM. Table calls retry 429s through our own backoff
+        # so they respect the per-table time budget.
+        self.Table_Checker = table_checker or ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=self.model, max_tokens=1,
+                                                       timeout=TABLE_TIMEOUT, max_retries=0)
+        self.Table_Extractor = table_extractor or ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=self.model,
+                                                           timeout=TABLE_TIMEOUT, max_retries=0)
+        self.Chat = chat or ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=self.model)
 
-    # Function to filter and extract information from tables
-    def extract_info_from_table(self, table):
+    def _invoke_with_backoff(self, prompt, llm, inputs, deadline):
+        for attempt in range(TABLE_MAX_RETRIES + 1):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TableTimeoutError("Table processing exceeded its time budget")
+            # Each Groq request may only use what is left of the table's
+            # budget; injected stubs are called as they are
+            model = llm.bind(timeout=remaining) if isinstance(llm, BaseChatModel) else llm
+            try:
+                return (prompt | model | StrOutputParser()).invoke(inputs)
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt == TABLE_MAX_RETRIES:
+                    raise
+                delay = _retry_after(e) or TABLE_BACKOFF_BASE * (2 ** attempt)
+                delay += random.uniform(0, delay / 2)
+                if time.time() + delay > deadline:
+                    raise TableTimeoutError("Table processing exceeded its time budget") from e
+                time.sleep(delay)
 
+    def _check_table(self, table, deadline):
         prompt_template = ChatPromptTemplate.from_messages([
             ("user", "{table}\n\nAnalyze the above table and tell me whether it is a proper table or no. Just return 'True' or 'False' based on you decision. I want no other output.")
         ])
 
-        chain = prompt_template | self.Table_Checker | StrOutputParser()
-        extracted_text = chain.invoke({"table": table})
+        extracted_text = self._invoke_with_backoff(prompt_template, self.Table_Checker, {"table": table}, deadline)
+
+        return True if 'True' in extracted_text else False
 
-        good_table = True if 'True' in extracted_text else False
+    # Function to filter and extract information from tables. Tables from the
+    # extraction services carry a local quality verdict; 'good' ones skip
+    # the classifier call, and well-formed ones arrive already serialized.
+    def extract_info_from_table(self, table, timeout=TABLE_TIMEOUT):
+        deadline = time.time() + timeout
 
-        if not good_table:
+        if isinstance(table, dict):
+            if table.get('serialized'):
+                return table['serialized']
+            verified = table.get('quality') == 'good'
+            table = table['text']
+        else:
+            verified = False
+
+        if not verified and not self._check_table(table, deadline):
             return
 
         # Define a prompt template for table summarization
@@ -44,42 +127,152 @@ class LLMService:
         ])
 
         # Run LLM on the table data
-        chain = prompt_template | self.Table_Extractor | StrOutputParser()
-        extracted_text = chain.invoke({"table": table})
+        extracted_text = self._invoke_with_backoff(prompt_template, self.Table_Extractor, {"table": table}, deadline)
 
         return extracted_text
 
+    # Process all tables of a document concurrently; results keep table order
+    # and are None for tables that were rejected, failed, timed out or not
+    # started because cancel_event was set. on_progress(done, total) is
+    # called as tables finish.
+    def extract_info_from_tables(self, tables, max_concurrency=TABLE_CONCURRENCY, timeout=TABLE_TIMEOUT,
+                                 on_progress=None, cancel_event=None):
+        if not tables:
+            return []
+
+        def process(table):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            try:
+                return self.extract_info_from_table(table, timeout=timeout)
+            except Exception as e:
+                print(f"Table extraction error: {e}")
+                return None
+
+        results = [None] * len(tables)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(tables)))) as executor:
+            futures = {executor.submit(process, table): index for index, table in enumerate(tables)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if on_progress is not None:
+                    on_progress(done, len(tables))
+        return results
+
     def _is_comparative_query(self, question):
         return bool(COMPARATIVE_KEYWORDS.search(question))
 
-    # Function to run RAG-based QA
-    def ask_question(self, vector_db, question):
+    # Scored dense search, fused with BM25 results through reciprocal rank
+    # fusion when a lexical index is given. The dense similarity scores pick
+    # how many chunks to use (up to max_k; 0 means nothing is relevant).
+    # Chunks only BM25 found are read back from the vector store by ID.
+    # With require_context the best hit is kept even when the policy finds
+    # nothing relevant. Returns (docs, dense scores, chosen k).
+    def _retrieve(self, vector_db, question, max_k, sources=None, question_vector=None, lexical_index=None,
+                  require_context=False):
+        search_kwargs = {"k": max(HYBRID_CANDIDATES, max_k) if lexical_index is not None else max_k}
+        if sources is not None:
+            search_kwargs["filter"] = {"source": {"$in": list(sources)}}
+
+        if question_vector is None:
+            question_vector = vector_db.embeddings.embed_query(question)
+        scored = vector_db.similarity_search_by_vector_with_relevance_scores(question_vector, **search_kwargs)
+        dense_docs = [doc for doc, _ in scored]
+        scores = [distance_to_similarity(distance) for _, distance in scored]
+
+        # The lexical search runs first: an exact identifier or name that the
+        # embedding model scores low still counts as relevant context
+        lexical = lexical_index.search(question, HYBRID_CANDIDATES, sources) if lexical_index is not None else []
+
+        k = choose_k(scores, max_k)
+        if k == 0 and require_context and dense_docs:
+            k = 1
+        if k == 0:
+            # Nothing relevant by meaning: answer from strong term matches
+            # alone, or skip the LLM when there are none either
+            lexical_ids = [chunk_id for chunk_id, score in lexical
+                           if score >= RETRIEVAL_MIN_LEXICAL_SCORE][:min(max_k, max(1, RETRIEVAL_MIN_K))]
+            docs = self._load_docs(vector_db, lexical_ids, {})
+            return docs, scores, len(docs)
+        if lexical_index is None:
+            return dense_docs[:k], scores, k
+
+        # Weak dense hits do not get a fusion vote, unless the policy kept them
+        dense_ids = [doc.id for doc, score in zip(dense_docs, scores) if score >= RETRIEVAL_MIN_SCORE]
+        if len(dense_ids) < k:
+            dense_ids = [doc.id for doc in dense_docs[:k]]
+        lexical_ids = [chunk_id for chunk_id, _ in lexical]
+        fused_ids = reciprocal_rank_fusion([dense_ids, lexical_ids], k=RRF_K)[:k]
+        return self._load_docs(vector_db, fused_ids, {doc.id: doc for doc in dense_docs}), scores, k
+
+    @staticmethod
+    def _load_docs(vector_db, chunk_ids, docs_by_id):
+        # Chunks found only by the lexical search are read from the store
+        missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in docs_by_id]
+        if missing:
+            stored = vector_db.get(ids=missing, include=['documents', 'metadatas'])
+            for chunk_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+                docs_by_id[chunk_id] = Document(id=chunk_id, page_content=text, metadata=metadata or {})
+        return [docs_by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in docs_by_id]
+
+    # Comparative retrieval: a top-m query per document, run concurrently, so
+    # one dominant document can't crowd the others out. Each document gets
+    # an equal share of the budget (at least one chunk) and the results are
+    # interleaved by rank, which lets the context budget trim every document
+    # evenly. The result never exceeds the budget: with more documents than
+    # chunks, the documents with the weakest best match are left out.
+    def _retrieve_per_source(self, vector_db, question, budget, sources, question_vector=None, lexical_index=None):
+        if question_vector is None:
+            question_vector = vector_db.embeddings.embed_query(question)
+        per_source = max(1, budget // len(sources))
+
+        def retrieve(source):
+            return self._retrieve(vector_db, question, per_source, [source], question_vector, lexical_index,
+                                  require_context=True)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(RETRIEVAL_CONCURRENCY, len(sources)))) as executor:
+            results = list(executor.map(retrieve, sources))
+
+        ranked = sorted(results, key=lambda result: result[1][0] if result[1] else float('-inf'), reverse=True)
+        docs = []
+        for rank in range(per_source):
+            for source_docs, _, _ in ranked:
+                if rank < len(source_docs):
+                    docs.append(source_docs[rank])
+        docs = docs[:budget]
+        scores = sorted((score for _, source_scores, k in results for score in source_scores[:k]), reverse=True)
+        return docs, scores, len(docs)
+
+    # Retrieval and prompt assembly shared by the blocking and streaming paths.
+    # sources restricts the search to those document IDs (the caller's
+    # session) inside the index, so other sessions' chunks are never scored.
+    # An already computed question_vector skips embedding the question again.
+    def _prepare_question(self, vector_db, question, sources=None, question_vector=None, lexical_index=None):
         is_comparative = self._is_comparative_query(question)
-        k = 20 if is_comparative else 8
+        k = COMPARATIVE_RETRIEVAL_K if is_comparative else RETRIEVAL_K
 
         # Manually handle retrieval to track latency
-        retriever = vector_db.as_retriever(search_kwargs={"k": k})
-
         start_retrieval = time.time()
-        docs = retriever.invoke(question)
+        if is_comparative and sources is not None and len(sources) > 1:
+            docs, scores, chosen_k = self._retrieve_per_source(vector_db, question, k, list(sources),
+                                                               question_vector, lexical_index)
+        else:
+            docs, scores, chosen_k = self._retrieve(vector_db, question, k, sources, question_vector, lexical_index)
         retrieval_time = time.time() - start_retrieval
 
-        # For comparative queries, ensure chunks from multiple sources are included
-        if is_comparative and docs:
-            sources = {}
-            for doc in docs:
-                src = doc.metadata.get("source", "unknown")
-                sources.setdefault(src, []).append(doc)
-            # If we have multiple sources, take top chunks from each source evenly
-            if len(sources) > 1:
-                per_source = max(4, k // len(sources))
-                balanced_docs = []
-                for src_docs in sources.values():
-                    balanced_docs.extend(src_docs[:per_source])
-                docs = balanced_docs
-
-        # Build context from retrieved documents
-        context = "\n\n".join(doc.page_content for doc in docs)
+        retrieval = {
+            'docs': docs,
+            'retrieval_time': retrieval_time,
+            'chosen_k': chosen_k,
+            'retrieval_scores': [round(score, 4) for score in scores[:max(k, chosen_k)]],
+        }
+
+        # Nothing relevant enough: answer without calling the LLM
+        if not docs:
+            return {**retrieval, 'chain': None, 'context_tokens_saved': 0, 'chunks_used': 0}
+
+        # Build a deduplicated, token-budgeted context from the retrieved chunks
+        built = build_context(docs, COMPARATIVE_CONTEXT_TOKEN_BUDGET if is_comparative else CONTEXT_TOKEN_BUDGET)
+        context = built['context']
 
         if is_comparative:
             system_msg = (
@@ -94,8 +287,37 @@ class LLMService:
             ("user", "{question}")
         ])
 
-        chain = prompt | self.Chat
-        response = chain.invoke({"context": context, "question": question})
+        return {
+            **retrieval,
+            'docs': docs,
+            'chain': prompt | self.Chat,
+            'inputs': {"context": context, "question": question},
+            'context_tokens_saved': built['tokens_saved'],
+            'chunks_used': built['chunks_used'],
+        }
+
+    def _no_context_result(self, prepared):
+        return {
+            'result': NO_CONTEXT_ANSWER,
+            'source_documents': [],
+            'retrieval_time': prepared['retrieval_time'],
+            'context_tokens_saved': 0,
+            'chosen_k': 0,
+            'retrieval_scores': prepared['retrieval_scores'],
+            'chunks_retrieved': 0,
+            'chunks_used': 0,
+            'tokens_input': 0,
+            'tokens_output': 0
+        }
+
+    # Function to run RAG-based QA
+    def ask_question(self, vector_db, question, sources=None, question_vector=None, lexical_index=None):
+        prepared = self._prepare_question(vector_db, question, sources, question_vector, lexical_index)
+        docs = prepared['docs']
+        if prepared['chain'] is None:
+            return self._no_context_result(prepared)
+
+        response = prepared['chain'].invoke(prepared['inputs'])
 
         # Extract token usage from Groq response metadata
         usage = response.response_metadata.get("token_usage", {})
@@ -105,8 +327,55 @@ class LLMService:
         return {
             'result': response.content,
             'source_documents': docs,
-            'retrieval_time': retrieval_time,
-            'chunks_count': len(docs),
+            'retrieval_time': prepared['retrieval_time'],
+            'context_tokens_saved': prepared['context_tokens_saved'],
+            'chosen_k': prepared['chosen_k'],
+            'retrieval_scores': prepared['retrieval_scores'],
+            # Retrieved, and sent to the LLM after merging, dedup and the budget
+            'chunks_retrieved': len(docs),
+            'chunks_used': prepared['chunks_used'],
+            'tokens_input': tokens_input,
+            'tokens_output': tokens_output
+        }
+
+    # Streaming variant: yields ('token', text) as Groq produces tokens, then
+    # one ('done', result) with the same fields as ask_question plus ttft
+    # (seconds from the call to the first token)
+    def stream_question(self, vector_db, question, sources=None, question_vector=None, lexical_index=None):
+        start = time.time()
+        prepared = self._prepare_question(vector_db, question, sources, question_vector, lexical_index)
+        docs = prepared['docs']
+        if prepared['chain'] is None:
+            yield 'token', NO_CONTEXT_ANSWER
+            yield 'done', {**self._no_context_result(prepared), 'ttft': time.time() - start}
+            return
+
+        parts = []
+        ttft = None
+        tokens_input = 0
+        tokens_output = 0
+        for chunk in prepared['chain'].stream(prepared['inputs']):
+            # Groq reports usage on the final chunk
+            usage = getattr(chunk, 'usage_metadata', None)
+            if usage:
+                tokens_input += usage.get('input_tokens', 0)
+                tokens_output += usage.get('output_tokens', 0)
+            if chunk.content:
+                if ttft is None:
+                    ttft = time.time() - start
+                parts.append(chunk.content)
+                yield 'token', chunk.content
+
+        yield 'done', {
+            'result': ''.join(parts),
+            'source_documents': docs,
+            'retrieval_time': prepared['retrieval_time'],
+            'context_tokens_saved': prepared['context_tokens_saved'],
+            'chosen_k': prepared['chosen_k'],
+            'retrieval_scores': prepared['retrieval_scores'],
+            'ttft': ttft if ttft is not None else time.time() - start,
+            'chunks_retrieved': len(docs),
+            'chunks_used': prepared['chunks_used'],
             'tokens_input': tokens_input,
             'tokens_output': tokens_output
         }
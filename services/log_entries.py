@@ -0,0 +1,39 @@
+import json
+
+# Request log format shared by the app's monitoring service and the
+# dashboard: request rows plus appended feedback events. Importing this
+# module has no side effects.
+
+
+def read_jsonl(path):
+    entries = []
+    if path.exists():
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except Exception:
+                    continue
+    return entries
+
+def merge_entries(entries):
+    """Fold feedback events into their request rows (one row per query)."""
+    rows = []
+    by_id = {}
+    pending = {}
+    for entry in entries:
+        if entry.get("type") == "feedback":
+            query_id = entry.get("id")
+            if query_id in by_id:
+                by_id[query_id]["feedback"] = entry.get("feedback")
+            else:
+                pending[query_id] = entry.get("feedback")
+            continue
+        row = dict(entry)
+        query_id = row.get("id")
+        if query_id is not None:
+            by_id[query_id] = row
+            if query_id in pending:
+                row["feedback"] = pending.pop(query_id)
+        rows.append(row)
+    return rows
@@ -1,9 +1,18 @@
 import time
 import json
 import os
+import queue
+import atexit
 import threading
+from contextlib import contextmanager
 from pathlib import Path
-from huggingface_hub import HfApi
+from huggingface_hub import HfApi, CommitOperationAdd
+from services.log_entries import read_jsonl, merge_entries
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process, the thread lock is enough
+    fcntl = None
 
 HF_TOKEN = os.getenv("HF_TOKEN")
 REPO_ID = "aniketp2009gmail/omnidoc-qa-logs"
@@ -11,74 +20,349 @@ LOGS_DIR = Path("logs")
 LOGS_DIR.mkdir(exist_ok=True)
 LOGS_FILE = LOGS_DIR / "rag_requests.jsonl"
 
+# Entries are shipped to the HF dataset in batches as new segment files
+# (segments/<timestamp>-<seq>.jsonl) instead of re-uploading the whole log.
+SEGMENTS_DIR = LOGS_DIR / "segments"
+SEGMENTS_DIR.mkdir(exist_ok=True)
+SEGMENTS_PATH_IN_REPO = "segments"
+
+SHIP_QUEUE_SIZE = int(os.getenv("LOG_SHIP_QUEUE_SIZE", 10000))
+SHIP_BATCH_SIZE = int(os.getenv("LOG_SHIP_BATCH_SIZE", 200))
+SHIP_INTERVAL = float(os.getenv("LOG_SHIP_INTERVAL", 60))
+
+# Feedback events are folded into their rows by a background compaction
+# once this many have been appended since the last one
+COMPACT_EVERY = int(os.getenv("LOG_COMPACT_EVERY", 1000))
+COMPACTING_FILE = LOGS_DIR / "rag_requests.compacting.jsonl"
+# PID of the process that detached COMPACTING_FILE
+COMPACTING_PID_FILE = LOGS_DIR / "rag_requests.compacting.pid"
+# Server workers append to the same log, so writes and compaction also take
+# a file lock shared between processes
+LOCK_FILE = LOGS_DIR / "rag_requests.lock"
+# Held by the worker that is uploading segments; the others skip the scan
+SHIP_LOCK_FILE = SEGMENTS_DIR / "ship.lock"
+
 _lock = threading.Lock()
 _api = HfApi(token=HF_TOKEN)
 
+_queue = queue.Queue(maxsize=SHIP_QUEUE_SIZE)
+_stop = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+_segment_seq = 0
+_repo_ready = False
+_events_since_compaction = 0
+_compacting = threading.Event()
+
+_metrics = {
+    "enqueued": 0,
+    "dropped": 0,
+    "written": 0,
+    "shipped": 0,
+    "segments_uploaded": 0,
+    "upload_errors": 0,
+    "last_flush": None,
+}
+
+@contextmanager
+def _log_lock():
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(LOCK_FILE, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@contextmanager
+def _ship_lock():
+    # Yields whether this process may upload; never waits on another
+    # worker's upload
+    if fcntl is None:
+        yield True
+        return
+    with open(SHIP_LOCK_FILE, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def _ensure_repo():
+    global _repo_ready
     try:
         _api.create_repo(repo_id=REPO_ID, repo_type="dataset", private=True, exist_ok=True)
+        _repo_ready = True
     except Exception:
         pass
 
-_ensure_repo()
-
-def _push():
+def _upload_segments(segment_paths):
+    # All pending segments go up as one commit, so a backlog costs one Hub
+    # round trip instead of one per file
+    operations = [
+        CommitOperationAdd(path_in_repo=f"{SEGMENTS_PATH_IN_REPO}/{segment_path.name}",
+                           path_or_fileobj=str(segment_path))
+        for segment_path in segment_paths
+    ]
+    message = f"Add {len(operations)} log segment(s)"
+    if not _repo_ready:
+        _ensure_repo()
     try:
-        _api.upload_file(
-            path_or_fileobj=str(LOGS_FILE),
-            path_in_repo="rag_requests.jsonl",
-            repo_id=REPO_ID,
-            repo_type="dataset",
-        )
+        _api.create_commit(repo_id=REPO_ID, repo_type="dataset", operations=operations, commit_message=message)
+        return True
     except Exception:
         _ensure_repo()
         try:
-            _api.upload_file(
-                path_or_fileobj=str(LOGS_FILE),
-                path_in_repo="rag_requests.jsonl",
-                repo_id=REPO_ID,
-                repo_type="dataset",
-            )
+            _api.create_commit(repo_id=REPO_ID, repo_type="dataset", operations=operations, commit_message=message)
+            return True
         except Exception as e:
             print(f"HF upload error: {e}")
+            return False
+
+def _count_entries(segment_path):
+    with open(segment_path) as f:
+        return sum(1 for line in f if line.strip())
+
+def _write_segment(batch):
+    global _segment_seq
+    _segment_seq += 1
+    segment_path = SEGMENTS_DIR / f"{int(time.time() * 1000)}-{os.getpid()}-{_segment_seq:06d}.jsonl"
+    # Written under a temporary name so that no shipper (of this or another
+    # worker) picks up a segment before it is complete
+    tmp_path = segment_path.with_suffix(".jsonl.tmp")
+    with open(tmp_path, "w") as f:
+        for entry in batch:
+            f.write(json.dumps(entry) + "\n")
+    tmp_path.replace(segment_path)
+    return segment_path
+
+def _flush(batch):
+    if batch:
+        _write_segment(batch)
+        _metrics["written"] += len(batch)
+
+    # Upload every pending segment, including ones left over from failed
+    # flushes, a previous run or other workers; segments are only removed
+    # once uploaded. One worker uploads at a time, the others' segments wait
+    # for its next scan or their own.
+    with _ship_lock() as shipping:
+        if shipping:
+            segment_paths = sorted(SEGMENTS_DIR.glob("*.jsonl"))
+            if segment_paths:
+                entries = sum(_count_entries(segment_path) for segment_path in segment_paths)
+                if _upload_segments(segment_paths):
+                    for segment_path in segment_paths:
+                        segment_path.unlink(missing_ok=True)
+                    _metrics["segments_uploaded"] += len(segment_paths)
+                    _metrics["shipped"] += entries
+                else:
+                    _metrics["upload_errors"] += 1
+
+    _metrics["last_flush"] = time.time()
+
+def _run_shipper():
+    batch = []
+    last_flush = time.time()
+    while True:
+        timeout = max(0.0, SHIP_INTERVAL - (time.time() - last_flush))
+        try:
+            item = _queue.get(timeout=timeout)
+            if item is not None:
+                batch.append(item)
+        except queue.Empty:
+            pass
+
+        stopping = _stop.is_set()
+        if stopping:
+            while True:
+                try:
+                    item = _queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+
+        if len(batch) >= SHIP_BATCH_SIZE or time.time() - last_flush >= SHIP_INTERVAL or stopping:
+            try:
+                _flush(batch)
+            except Exception as e:
+                print(f"Log shipping error: {e}")
+            batch = []
+            last_flush = time.time()
+
+        if stopping:
+            return
+
+def _ensure_worker():
+    # Started lazily so that forked processes get their own shipper thread
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_shipper, name="log-shipper", daemon=True)
+            _worker.start()
+
+def _enqueue(entry):
+    _ensure_worker()
+    try:
+        _queue.put_nowait(entry)
+        _metrics["enqueued"] += 1
+    except queue.Full:
+        _metrics["dropped"] += 1
+
+def shutdown(timeout=30):
+    """Flush queued entries and stop the shipper thread."""
+    _stop.set()
+    if _worker is not None and _worker.is_alive():
+        # Wake the worker if it is waiting on an empty queue
+        try:
+            _queue.put_nowait(None)
+        except queue.Full:
+            pass
+        _worker.join(timeout)
+
+atexit.register(shutdown)
+
+def get_metrics():
+    return {
+        **_metrics,
+        "queue_depth": _queue.qsize(),
+        "queue_capacity": SHIP_QUEUE_SIZE,
+        "pending_segments": len(list(SEGMENTS_DIR.glob("*.jsonl"))),
+    }
 
 def log_request(query_id, query, answer, latency, tokens_input, tokens_output,
-                chunks_retrieved, error=None):
+                chunks_retrieved, error=None, ttft=None, cache_hit=False, context_tokens_saved=0,
+                chosen_k=None, retrieval_scores=None, chunks_used=None):
     entry = {
         "id": query_id,
         "timestamp": time.time(),
         "query": query,
         "answer": answer,
         "latency": latency,
+        "ttft": ttft,
         "tokens_input": tokens_input,
         "tokens_output": tokens_output,
         "chunks_retrieved": chunks_retrieved,
+        "chunks_used": chunks_used,
+        "cache_hit": cache_hit,
+        "context_tokens_saved": context_tokens_saved,
+        "chosen_k": chosen_k,
+        "retrieval_scores": retrieval_scores,
         "error": str(error) if error else None,
         "feedback": None,
     }
-    with _lock:
+    with _log_lock():
         with open(LOGS_FILE, "a") as f:
             f.write(json.dumps(entry) + "\n")
-    _push()
+    _enqueue(entry)
 
 def record_feedback(query_id, is_relevant):
-    with _lock:
-        # Read all entries, update the matching one
-        entries = []
+    # Feedback is an appended event rather than an in-place edit, so a click
+    # costs one small write and never blocks log_request behind a rewrite
+    event = {
+        "type": "feedback",
+        "id": query_id,
+        "timestamp": time.time(),
+        "feedback": is_relevant,
+    }
+    global _events_since_compaction
+    with _log_lock():
+        with open(LOGS_FILE, "a") as f:
+            f.write(json.dumps(event) + "\n")
+        _events_since_compaction += 1
+        should_compact = _events_since_compaction >= COMPACT_EVERY and not _compacting.is_set()
+        if should_compact:
+            _compacting.set()
+    _enqueue(event)
+    if should_compact:
+        threading.Thread(target=_compact, name="log-compactor", daemon=True).start()
+
+def _compaction_owner_alive():
+    # Whether the process that detached the log is still merging it. This
+    # process only compacts one log at a time, so its own PID means the file
+    # was left by an earlier process that had the same PID, or by a failed
+    # run. Without fcntl there is only ever one process.
+    if fcntl is None:
+        return False
+    try:
+        pid = int(COMPACTING_PID_FILE.read_text())
+    except (OSError, ValueError):
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _restore_detached_log():
+    # Put the detached log's rows back in front of anything appended since.
+    # Called with _log_lock() held.
+    tmp_file = LOGS_FILE.with_suffix(".jsonl.tmp")
+    with open(tmp_file, "w") as out, open(COMPACTING_FILE, "r") as head:
+        out.writelines(head)
         if LOGS_FILE.exists():
-            with open(LOGS_FILE, "r") as f:
-                for line in f:
-                    try:
-                        entries.append(json.loads(line))
-                    except Exception:
-                        continue
-
-        for entry in entries:
-            if entry.get("id") == query_id:
-                entry["feedback"] = is_relevant
-                break
-
-        with open(LOGS_FILE, "w") as f:
-            for entry in entries:
-                f.write(json.dumps(entry) + "\n")
-    _push()
+            with open(LOGS_FILE, "r") as tail:
+                out.writelines(tail)
+    tmp_file.replace(LOGS_FILE)
+    COMPACTING_FILE.unlink(missing_ok=True)
+    COMPACTING_PID_FILE.unlink(missing_ok=True)
+
+def _compact():
+    global _events_since_compaction
+    try:
+        # Detach the current log so appends continue into a fresh file while
+        # the old one is merged outside the lock
+        with _log_lock():
+            if COMPACTING_FILE.exists():
+                # Another worker process may already be compacting; a log
+                # left by a process that died is restored first
+                if _compaction_owner_alive():
+                    return
+                _restore_detached_log()
+            if not LOGS_FILE.exists():
+                return
+            LOGS_FILE.replace(COMPACTING_FILE)
+            COMPACTING_PID_FILE.write_text(str(os.getpid()))
+            _events_since_compaction = 0
+
+        merged = merge_entries(read_jsonl(COMPACTING_FILE))
+        tmp_file = LOGS_FILE.with_suffix(".jsonl.tmp")
+        with open(tmp_file, "w") as f:
+            for row in merged:
+                f.write(json.dumps(row) + "\n")
+
+        # Only the tail written during the merge is copied under the lock
+        with _log_lock():
+            if LOGS_FILE.exists():
+                with open(tmp_file, "a") as out, open(LOGS_FILE, "r") as tail:
+                    out.writelines(tail)
+            tmp_file.replace(LOGS_FILE)
+            COMPACTING_FILE.unlink(missing_ok=True)
+            COMPACTING_PID_FILE.unlink(missing_ok=True)
+    except Exception as e:
+        print(f"Log compaction error: {e}")
+    finally:
+        _compacting.clear()
+
+def _recover_compaction():
+    # A compaction interrupted by a restart leaves the detached log behind.
+    # Runs at import, when another worker process may still be compacting
+    # it, so the log is only restored once its owner is gone.
+    with _log_lock():
+        if COMPACTING_FILE.exists() and not _compaction_owner_alive():
+            _restore_detached_log()
+
+_recover_compaction()
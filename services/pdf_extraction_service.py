@@ -1,29 +1,71 @@
+import os
 import fitz
 import tabula
 from io import BytesIO
 import base64
 from PIL import Image
+from services.table_processing import prepare_tables
 
-def extract_from_pdf(pdf_file):
+# 'pymupdf' finds tables on the already-open document in-process; 'tabula'
+# starts Tabula (a JVM) and parses the PDF a second time. With jpype1
+# installed, tabula-py keeps one JVM alive in-process instead of spawning
+# a java subprocess per call.
+PDF_TABLE_BACKEND = os.getenv('PDF_TABLE_BACKEND', 'pymupdf')
+TABLE_BACKENDS = ('pymupdf', 'tabula')
 
-    # Open the PDF file
-    doc = fitz.open(stream=BytesIO(pdf_file.read()))
-    
-    # Extract text from each page
-    text = ""
+# Checked at import so a typo fails at startup, not on the first upload
+if PDF_TABLE_BACKEND not in TABLE_BACKENDS:
+    raise ValueError(f"Unknown PDF_TABLE_BACKEND {PDF_TABLE_BACKEND!r}; expected one of {', '.join(TABLE_BACKENDS)}")
+
+
+def open_pdf(pdf_file):
+    # Open from raw bytes without an extra BytesIO copy; file objects are
+    # read once
+    data = pdf_file if isinstance(pdf_file, (bytes, bytearray)) else pdf_file.read()
+    return fitz.open(stream=data, filetype="pdf")
+
+
+def _find_page_tables(page):
+    dataframes = []
+    for table in page.find_tables().tables:
+        try:
+            df = table.to_pandas()
+        except Exception:
+            continue
+        # Kept through prepare_tables so table chunks know their page
+        df.attrs['page'] = page.number + 1
+        dataframes.append(df)
+    return dataframes
+
+
+def get_pdf_outline(doc):
+    # Bookmarks as {page: [(level, title), ...]}, for section paths; PDFs
+    # without an outline give {}
+    outline = {}
+    for level, title, page in doc.get_toc(simple=True):
+        if page >= 1 and title.strip():
+            outline.setdefault(page, []).append((level, title))
+    return outline
+
+
+def iter_pdf_pages(doc, find_tables=False):
+    # Yield text one page at a time so chunking and embedding can start
+    # before the last page is parsed; only one page is loaded at once.
+    # With find_tables, each page also carries its PyMuPDF table DataFrames.
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
-        text += page.get_text() + "\n"
+        result = {
+            "page": page_num + 1,
+            "text": page.get_text(),
+        }
+        if find_tables:
+            result["tables"] = _find_page_tables(page)
+        yield result
 
-    # Reset the file pointer to the beginning
-    pdf_file.seek(0)
 
-    # Extract tables from the PDF file and convert DataFrames to strings
-    raw_tables = tabula.read_pdf(pdf_file, pages="all", multiple_tables=True, encoding='ISO-8859-1')
-    tables = [df.to_string(index=False) for df in raw_tables]
-    
-    # Extract images from the PDF
-    extracted_images = []
+def iter_pdf_images(doc):
+    # Opt-in and lazy: each image is decoded and re-encoded only when the
+    # caller asks for it
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
         image_list = page.get_images(full=True)
@@ -42,18 +84,32 @@ def extract_from_pdf(pdf_file):
             # Encode image bytes as base64
             encoded_image = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
 
-            # Store image in list with metadata
-            extracted_images.append({
+            # Store image with metadata
+            yield {
                 "page": page_num + 1,
                 "index": image_index + 1,
                 "format": "jpeg",  # JPEG format
                 "image_base64": encoded_image,  # Base64-encoded image
                 "width": img_pil.width,
                 "height": img_pil.height
-            })
+            }
+
+
+def extract_pdf_tables(pdf_file, backend=PDF_TABLE_BACKEND):
+    # Extract tables from the PDF (an open document, bytes or a file), drop
+    # obvious junk locally and convert the rest to strings
+    if backend == 'pymupdf':
+        doc = pdf_file if isinstance(pdf_file, fitz.Document) else open_pdf(pdf_file)
+        raw_tables = []
+        for page_num in range(len(doc)):
+            raw_tables.extend(_find_page_tables(doc.load_page(page_num)))
+    elif backend == 'tabula':
+        if isinstance(pdf_file, fitz.Document):
+            pdf_file = pdf_file.tobytes()
+        if isinstance(pdf_file, (bytes, bytearray)):
+            pdf_file = BytesIO(pdf_file)
+        raw_tables = tabula.read_pdf(pdf_file, pages="all", multiple_tables=True, encoding='ISO-8859-1')
+    else:
+        raise ValueError(f"Unknown PDF table backend: {backend}")
 
-    return {
-        'text': text,
-        'tables': tables,
-        'images': extracted_images
-    }
\ No newline at end of file
+    return prepare_tables(raw_tables)
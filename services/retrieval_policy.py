@@ -0,0 +1,43 @@
+import os
+
+# Adaptive k: dense hits below RETRIEVAL_MIN_SCORE (cosine similarity) are
+# never used, the ranking is cut at the first drop of RETRIEVAL_ELBOW_GAP or
+# more. When even the best hit is below RETRIEVAL_NO_CONTEXT_SCORE, only BM25
+# hits scoring at least RETRIEVAL_MIN_LEXICAL_SCORE (exact identifiers and
+# names the embedding model doesn't know) are used, and without any the
+# question is answered without calling the LLM
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', 0.25))
+RETRIEVAL_ELBOW_GAP = float(os.getenv('RETRIEVAL_ELBOW_GAP', 0.12))
+RETRIEVAL_NO_CONTEXT_SCORE = float(os.getenv('RETRIEVAL_NO_CONTEXT_SCORE', 0.2))
+RETRIEVAL_MIN_K = int(os.getenv('RETRIEVAL_MIN_K', 2))
+RETRIEVAL_MIN_LEXICAL_SCORE = float(os.getenv('RETRIEVAL_MIN_LEXICAL_SCORE', 1.0))
+
+NO_CONTEXT_ANSWER = "I couldn't find anything in your documents that answers this question."
+
+
+def distance_to_similarity(distance):
+    # Chroma's default space is squared L2; all-MiniLM-L6-v2 vectors are
+    # unit length, so cosine similarity = 1 - d / 2
+    return 1.0 - distance / 2.0
+
+
+def choose_k(scores, max_k):
+    """Number of top dense hits to use, given similarity scores sorted best first.
+
+    Returns 0 when no dense hit is relevant enough to answer from.
+    """
+    if not scores or scores[0] < RETRIEVAL_NO_CONTEXT_SCORE:
+        return 0
+
+    relevant = 0
+    while relevant < min(len(scores), max_k) and scores[relevant] >= RETRIEVAL_MIN_SCORE:
+        relevant += 1
+    if relevant == 0:
+        # Weak but not hopeless: answer from the best hit alone
+        return 1
+
+    # Cut at the first large drop, but not below the minimum
+    for i in range(max(1, RETRIEVAL_MIN_K), relevant):
+        if scores[i - 1] - scores[i] >= RETRIEVAL_ELBOW_GAP:
+            return i
+    return relevant
@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+from collections import Counter
+from models.state_store import MemoryStore
+
+# Idle sessions are evicted after SESSION_TTL seconds, and least recently
+# used sessions are evicted while the estimated footprint exceeds the budget
+SESSION_TTL = int(os.getenv('SESSION_TTL', 3600))
+SESSION_MEMORY_BUDGET = int(os.getenv('SESSION_MEMORY_BUDGET', 512 * 1024 * 1024))
+SESSION_CLEANUP_INTERVAL = int(os.getenv('SESSION_CLEANUP_INTERVAL', 60))
+
+# Rough in-memory cost of one stored chunk: a 384-d float32 vector, the HNSW
+# links, the chunk text and its metadata
+ESTIMATED_CHUNK_BYTES = 4096
+
+
+class SessionManager:
+    """Per-session state keyed by the client's X-Session-Id.
+
+    Sessions live in a state store, so with a shared store any worker
+    process can serve any session. get() returns a copy; changes are made
+    through update(), which applies them atomically. on_evict(session) is
+    called outside the store's transaction for every evicted session, so it
+    can release the session's documents. chunk_count(doc_id) returns the
+    number of stored chunks of a document, for memory accounting.
+    """
+
+    def __init__(self, on_evict, chunk_count, store=None, ttl=SESSION_TTL,
+                 memory_budget=SESSION_MEMORY_BUDGET, cleanup_interval=SESSION_CLEANUP_INTERVAL):
+        self.on_evict = on_evict
+        self.chunk_count = chunk_count
+        self.store = store or MemoryStore()
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.cleanup_interval = cleanup_interval
+        self._lock = threading.Lock()
+        self._cleaner = None
+        self._evictions = {'ttl': 0, 'memory': 0}
+
+    def _ensure_cleaner(self):
+        # Started lazily so that forked processes get their own cleaner thread
+        with self._lock:
+            if self._cleaner is not None and self._cleaner.is_alive():
+                return
+            self._cleaner = threading.Thread(target=self._run_cleaner, name='session-cleaner', daemon=True)
+            self._cleaner.start()
+
+    def _run_cleaner(self):
+        while True:
+            time.sleep(self.cleanup_interval)
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"Session cleanup error: {e}")
+
+    @staticmethod
+    def _new_session():
+        return {'chat_history': [], 'uploads': {}}
+
+    def get(self, sid):
+        self._ensure_cleaner()
+        with self.store.transaction():
+            session = self.store.get('sessions', sid)
+            if session is None:
+                session = self._new_session()
+                self.store.put('sessions', sid, session)
+            self.store.put('session_access', sid, time.time())
+        return session
+
+    def update(self, sid, fn):
+        """Apply fn(session) to the stored session and save it; returns fn's result."""
+        self._ensure_cleaner()
+        with self.store.transaction():
+            session = self.store.get('sessions', sid) or self._new_session()
+            result = fn(session)
+            self.store.put('sessions', sid, session)
+            self.store.put('session_access', sid, time.time())
+        return result
+
+    def _pop(self, sid):
+        self.store.delete('session_access', sid)
+        session = self.store.get('sessions', sid)
+        self.store.delete('sessions', sid)
+        return session
+
+    def evict(self, sid):
+        with self.store.transaction():
+            session = self._pop(sid)
+        if session is not None:
+            self.on_evict(session)
+
+    def _session_bytes(self, session, chunk_counts):
+        chat_bytes = sum(len(message['content']) for message in session['chat_history'])
+        chunks = sum(chunk_counts.get(doc_id, 0) for doc_id in session['uploads'])
+        return chunks, chat_bytes + chunks * ESTIMATED_CHUNK_BYTES
+
+    def _footprint(self, sessions, chunk_counts):
+        # Shared documents are stored once, so count each one once
+        doc_ids = {doc_id for session in sessions for doc_id in session['uploads']}
+        chat_bytes = sum(len(m['content']) for session in sessions for m in session['chat_history'])
+        return chat_bytes + sum(chunk_counts.get(doc_id, 0) for doc_id in doc_ids) * ESTIMATED_CHUNK_BYTES
+
+    def _chunk_counts(self, sessions):
+        doc_ids = {doc_id for session in sessions for doc_id in session['uploads']}
+        return {doc_id: self.chunk_count(doc_id) for doc_id in doc_ids}
+
+    def _load(self):
+        # Sessions with their last access time, least recently used first
+        access = dict(self.store.items('session_access'))
+        sessions = dict(self.store.items('sessions'))
+        return sorted(((sid, sessions[sid], access.get(sid, 0.0)) for sid in sessions), key=lambda item: item[2])
+
+    def cleanup(self):
+        evicted = []
+        now = time.time()
+        with self.store.transaction():
+            live = []
+            for sid, session, seen in self._load():
+                if now - seen > self.ttl:
+                    self._pop(sid)
+                    evicted.append(session)
+                    self._evictions['ttl'] += 1
+                else:
+                    live.append((sid, session))
+
+            # Evict least recently used sessions until under the memory budget;
+            # a shared document only stops counting with its last session
+            sessions = [session for _, session in live]
+            chunk_counts = self._chunk_counts(sessions)
+            footprint = self._footprint(sessions, chunk_counts)
+            holders = Counter(doc_id for session in sessions for doc_id in session['uploads'])
+            for sid, session in live:
+                if footprint <= self.memory_budget:
+                    break
+                self._pop(sid)
+                footprint -= sum(len(message['content']) for message in session['chat_history'])
+                for doc_id in session['uploads']:
+                    holders[doc_id] -= 1
+                    if holders[doc_id] == 0:
+                        footprint -= chunk_counts.get(doc_id, 0) * ESTIMATED_CHUNK_BYTES
+                evicted.append(session)
+                self._evictions['memory'] += 1
+
+        for session in evicted:
+            self.on_evict(session)
+        return len(evicted)
+
+    def stats(self, top=20):
+        now = time.time()
+        items = [(session, now - seen) for _, session, seen in self._load()]
+
+        sessions = [session for session, _ in items]
+        chunk_counts = self._chunk_counts(sessions)
+        per_session = []
+        for session, idle in items:
+            chunks, estimated_bytes = self._session_bytes(session, chunk_counts)
+            per_session.append({
+                'documents': len(session['uploads']),
+                'chunks': chunks,
+                'estimated_bytes': estimated_bytes,
+                'idle_seconds': round(idle, 1),
+            })
+        per_session.sort(key=lambda s: s['estimated_bytes'], reverse=True)
+
+        # Session IDs are the clients' only credential, so they are not exposed.
+        # Eviction counts are for this worker process.
+        return {
+            'live_sessions': len(items),
+            'estimated_bytes': self._footprint(sessions, chunk_counts),
+            'memory_budget': self.memory_budget,
+            'ttl': self.ttl,
+            'evictions': dict(self._evictions),
+            'largest_sessions': per_session[:top],
+        }
@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+import pandas as pd
+
+# Tables scoring below the reject threshold are dropped locally, tables at or
+# above the accept threshold skip the LLM classifier, and only the ones in
+# between are escalated to Table_Checker
+TABLE_REJECT_THRESHOLD = float(os.getenv('TABLE_REJECT_THRESHOLD', 0.35))
+TABLE_ACCEPT_THRESHOLD = float(os.getenv('TABLE_ACCEPT_THRESHOLD', 0.8))
+
+_lock = threading.Lock()
+_stats = {'rejected': 0, 'accepted': 0, 'escalated': 0, 'serialized': 0}
+
+
+def _is_empty(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return True
+    return str(value).strip().lower() in ('', 'nan', 'none')
+
+
+def _has_header(df):
+    labels = [str(col).strip() for col in df.columns]
+    # Placeholder names from pandas (Unnamed: n) and PyMuPDF (Coln)
+    if not labels or any(not label or label.startswith('Unnamed:') or re.fullmatch(r'Col\d+', label) for label in labels):
+        return False
+    # A default RangeIndex (0, 1, 2, ...) means no header row was found
+    if all(isinstance(col, int) for col in df.columns):
+        return False
+    return len(set(labels)) == len(labels)
+
+
+def score_table(df):
+    """Score a table between 0 (junk) and 1 (clean) from cheap numeric features."""
+    n_rows, n_cols = df.shape
+    if n_rows < 1 or n_cols < 2:
+        return 0.0
+
+    cells = [value for row in df.itertuples(index=False) for value in row]
+    filled = [str(value).strip() for value in cells if not _is_empty(value)]
+    fill_ratio = len(filled) / len(cells)
+    if fill_ratio < 0.3:
+        return 0.0
+
+    # Layout tables hold long prose blocks; data tables hold short, similar cells
+    lengths = pd.Series([len(value) for value in filled])
+    mean_length = lengths.mean()
+    if mean_length > 200:
+        return 0.0
+    length_cv = lengths.std(ddof=0) / mean_length if mean_length else 0.0
+    length_score = max(0.0, 1 - max(0.0, mean_length - 40) / 160) * (1 - min(1.0, length_cv / 3) / 2)
+
+    column_score = min(1.0, (n_cols - 1) / 3)
+    row_score = min(1.0, n_rows / 3)
+    header_score = 1.0 if _has_header(df) else 0.0
+
+    return round(
+        0.4 * fill_ratio + 0.2 * header_score + 0.15 * column_score
+        + 0.1 * row_score + 0.15 * length_score,
+        4,
+    )
+
+
+def classify_table(df):
+    score = score_table(df)
+    if score < TABLE_REJECT_THRESHOLD:
+        verdict = 'junk'
+    elif score >= TABLE_ACCEPT_THRESHOLD:
+        verdict = 'good'
+    else:
+        verdict = 'ambiguous'
+
+    with _lock:
+        _stats[{'junk': 'rejected', 'good': 'accepted', 'ambiguous': 'escalated'}[verdict]] += 1
+    return verdict
+
+
+def is_well_formed(df):
+    # Clean headers and rectangular rows: nearly every cell is filled and no
+    # row is missing most of its columns
+    if not _has_header(df):
+        return False
+    total_filled = 0
+    for row in df.itertuples(index=False):
+        filled = sum(not _is_empty(value) for value in row)
+        if filled < max(2, 0.6 * len(row)):
+            return False
+        total_filled += filled
+    return total_filled >= 0.85 * df.size
+
+
+def serialize_table(df):
+    """Serialize each row as 'col: value; col: value'.
+
+    Rows are separated by blank lines so the text splitter chunks on row
+    boundaries.
+    """
+    labels = [str(col).strip() for col in df.columns]
+    records = []
+    for row in df.itertuples(index=False):
+        fields = [
+            f"{label}: {str(value).strip()}"
+            for label, value in zip(labels, row)
+            if not _is_empty(value)
+        ]
+        records.append('; '.join(fields))
+    return '\n\n'.join(records)
+
+
+def prepare_tables(dataframes):
+    """Drop junk tables and stringify the rest with their local verdict.
+
+    Well-formed tables are also serialized here, so they never reach the LLM.
+    """
+    tables = []
+    for df in dataframes:
+        verdict = classify_table(df)
+        if verdict == 'junk':
+            continue
+        table = {
+            'text': df.to_string(index=False),
+            'quality': verdict,
+        }
+        if df.attrs.get('page'):
+            table['page'] = df.attrs['page']
+        if verdict == 'good' and is_well_formed(df):
+            table['serialized'] = serialize_table(df)
+            with _lock:
+                _stats['serialized'] += 1
+        tables.append(table)
+    return tables
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+    # A rejected table saves both LLM calls, an accepted one saves the
+    # classifier, and a serialized (always accepted) one saves the extractor too
+    stats['llm_calls_avoided'] = 2 * stats['rejected'] + stats['accepted'] + stats['serialized']
+    return stats
@@ -1,92 +1,238 @@
+import os
 import re
+import json
+import hashlib
+import threading
+from pathlib import Path
 import requests
-from bs4 import BeautifulSoup, Comment
-from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, Tag
+from urllib.parse import urljoin, urldefrag
 import pandas as pd
+from services.table_processing import prepare_tables
 
+# lxml parses several times faster than the stdlib parser; fall back to
+# html.parser when it isn't installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
 
-def extract_content_from_website(url):
-    # Fetch webpage with browser-like headers
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.9',
-    }
-    response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
+WEB_TIMEOUT = float(os.getenv('WEB_TIMEOUT', 30))
+WEB_POOL_SIZE = int(os.getenv('WEB_POOL_SIZE', 10))
+
+# Set to a directory to keep fetched pages on disk and revalidate them with
+# ETag / Last-Modified instead of downloading them again
+WEB_CACHE_DIR = os.getenv('WEB_CACHE_DIR')
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+REMOVED_TAGS = {
+    'script', 'style', 'noscript', 'iframe', 'svg',
+    'nav', 'footer', 'header',
+    'aside', 'form', 'button',
+}
+HIDDEN_STYLE = re.compile(r'display\s*:\s*none', re.I)
+CONTENT_NAME = re.compile(r'content|main|article|post|entry', re.I)
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    # One pooled session per process (created lazily, so forked workers
+    # don't share sockets) gives keep-alive across fetches of the same host
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=WEB_POOL_SIZE, pool_maxsize=WEB_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(HEADERS)
+            _session = session
+        return _session
+
+
+class ResponseCache:
+    """On-disk page cache revalidated with ETag / Last-Modified."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.html"
+
+    def get(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            meta['text'] = body_path.read_text(encoding='utf-8')
+            return meta
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, text, etag, last_modified, final_url):
+        meta_path, body_path = self._paths(url)
+        tmp_path = body_path.with_suffix('.tmp')
+        tmp_path.write_text(text, encoding='utf-8')
+        tmp_path.replace(body_path)
+        tmp_path = meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'etag': etag, 'last_modified': last_modified, 'url': final_url}, f)
+        tmp_path.replace(meta_path)
+
+
+_response_cache = ResponseCache(WEB_CACHE_DIR) if WEB_CACHE_DIR else None
+_stats = {'fetched': 0, 'revalidated': 0}
+
+
+def fetch_html(url, session=None):
+    """Return (html, final_url), revalidating a cached copy when there is one."""
+    session = session or get_session()
+    cached = _response_cache.get(url) if _response_cache else None
+
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    response = session.get(url, headers=headers, timeout=WEB_TIMEOUT, allow_redirects=True)
+    if cached and response.status_code == 304:
+        _stats['revalidated'] += 1
+        return cached['text'], cached.get('url') or url
     response.raise_for_status()
+    _stats['fetched'] += 1
 
     # Handle encoding - requests sometimes guesses wrong
     if response.encoding and response.encoding.lower() != 'utf-8':
         response.encoding = response.apparent_encoding
+    text = response.text
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if _response_cache and (etag or last_modified):
+        _response_cache.put(url, text, etag, last_modified, response.url)
+    return text, response.url
 
-    soup = BeautifulSoup(response.text, 'html.parser')
 
-    # Extract tables BEFORE removing elements (so we don't lose tables in removed sections)
-    tables = _extract_tables(soup)
+def get_stats():
+    return dict(_stats)
 
-    # Extract clean text
-    text = _extract_text(soup)
 
-    if not text or len(text.strip()) < 50:
+def extract_content_from_website(url):
+    html, final_url = fetch_html(url)
+    content = extract_content_from_html(html, base_url=final_url)
+
+    if not content['text'] or len(content['text'].strip()) < 50:
         raise ValueError(f"Could not extract meaningful content from {url}. The page may require JavaScript or may be blocking automated access.")
 
-    return {
-        'text': text,
-        'tables': tables,
-        'images': []
-    }
+    return content
+
 
+def _is_hidden(tag):
+    return (
+        tag.has_attr('hidden')
+        or tag.get('aria-hidden') == 'true'
+        or bool(HIDDEN_STYLE.search(tag.get('style', '')))
+    )
 
-def _extract_text(soup):
-    # Work on a copy so we don't mutate the original
-    soup = BeautifulSoup(str(soup), 'html.parser')
 
-    # Remove non-content elements
-    tags_to_remove = [
-        'script', 'style', 'noscript', 'iframe', 'svg',
-        'nav', 'footer', 'header',
-        'aside', 'form', 'button',
-    ]
-    for tag in soup.find_all(tags_to_remove):
-        tag.decompose()
+def _content_rank(tag):
+    # Lower is a better main-content candidate; None if it isn't one
+    if tag.name == 'main':
+        return 0
+    if tag.name == 'article':
+        return 1
+    if tag.name == 'div':
+        if tag.get('role') == 'main':
+            return 2
+        if CONTENT_NAME.search(tag.get('id') or ''):
+            return 3
+        if CONTENT_NAME.search(' '.join(tag.get('class') or [])):
+            return 4
+    return None
 
-    # Remove HTML comments
-    for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
-        comment.extract()
 
-    # Remove hidden elements
-    for tag in soup.find_all(attrs={'style': re.compile(r'display\s*:\s*none', re.I)}):
-        tag.decompose()
-    for tag in soup.find_all(attrs={'hidden': True}):
-        tag.decompose()
-    for tag in soup.find_all(attrs={'aria-hidden': 'true'}):
+def extract_content_from_html(html, base_url=None):
+    # Parse once and walk the tree once: tables and links are collected
+    # (including those inside sections that get removed, since navigation
+    # is where most links live), non-content and hidden elements are marked
+    # without descending into them, and the best main-content candidate is
+    # picked on the way
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    tables = []
+    anchors = []
+    removed = []
+    main_content = None
+    main_rank = None
+
+    # Pre-order walk, so tags are visited in document order and the first
+    # candidate of the best rank wins, as with find()
+    stack = [child for child in reversed(soup.contents) if isinstance(child, Tag)]
+    while stack:
+        tag = stack.pop()
+        if tag.name in REMOVED_TAGS or _is_hidden(tag):
+            removed.append(tag)
+            tables.extend(tag.find_all('table'))
+            anchors.extend(tag.find_all('a', href=True))
+            continue
+        if tag.name == 'table':
+            tables.append(tag)
+        elif tag.name == 'a' and tag.has_attr('href'):
+            anchors.append(tag)
+        rank = _content_rank(tag)
+        if rank is not None and (main_rank is None or rank < main_rank):
+            main_content, main_rank = tag, rank
+        stack.extend(child for child in reversed(tag.contents) if isinstance(child, Tag))
+
+    table_dataframes = _tables_to_dataframes(tables)
+    links = _resolve_links(anchors, base_url)
+
+    for tag in removed:
         tag.decompose()
 
-    # Try to find the main content area first
-    main_content = (
-        soup.find('main') or
-        soup.find('article') or
-        soup.find('div', role='main') or
-        soup.find('div', id=re.compile(r'content|main|article|post|entry', re.I)) or
-        soup.find('div', class_=re.compile(r'content|main|article|post|entry', re.I))
-    )
+    source = main_content if main_content is not None else soup.find('body') or soup
+    return {
+        'text': _clean_text(source.get_text(separator='\n', strip=True)),
+        'tables': prepare_tables(table_dataframes),
+        'images': [],
+        'links': links,
+        # (level, text) in document order, for the chunker's section paths
+        'headings': [(int(tag.name[1]), tag.get_text(separator='\n', strip=True))
+                     for tag in source.find_all(HEADING_TAGS)]
+    }
 
-    source = main_content if main_content else soup.find('body') or soup
 
-    # Extract text with newline separators
-    raw_text = source.get_text(separator='\n', strip=True)
+def _resolve_links(anchors, base_url):
+    # Absolute http(s) URLs without fragments, in document order, once each
+    links = []
+    seen = set()
+    for anchor in anchors:
+        href = anchor['href'].strip()
+        url = urldefrag(urljoin(base_url, href) if base_url else href)[0]
+        if url.startswith(('http://', 'https://')) and url not in seen:
+            seen.add(url)
+            links.append(url)
+    return links
 
-    # Clean up the text
-    lines = raw_text.splitlines()
-    cleaned_lines = []
-    for line in lines:
-        line = line.strip()
-        # Skip very short lines (likely menu items, icons, etc.)
-        if len(line) < 3:
-            continue
-        cleaned_lines.append(line)
 
-    text = '\n'.join(cleaned_lines)
+def _clean_text(raw_text):
+    # Skip very short lines (likely menu items, icons, etc.)
+    lines = [line.strip() for line in raw_text.splitlines()]
+    text = '\n'.join(line for line in lines if len(line) >= 3)
 
     # Collapse multiple blank lines
     text = re.sub(r'\n{3,}', '\n\n', text)
@@ -94,9 +240,9 @@ def _extract_text(soup):
     return text.strip()
 
 
-def _extract_tables(soup):
-    tables = []
-    for table in soup.find_all('table'):
+def _tables_to_dataframes(tables):
+    dataframes = []
+    for table in tables:
         table_data = []
         headers = [header.get_text(strip=True) for header in table.find_all('th')]
         rows = table.find_all('tr')
@@ -112,6 +258,6 @@ def _extract_tables(soup):
                 df = pd.DataFrame(table_data, columns=headers)
             else:
                 df = pd.DataFrame(table_data)
-            tables.append(df.to_string(index=False))
+            dataframes.append(df)
 
-    return tables
+    return dataframes
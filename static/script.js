@@ -50,6 +50,9 @@ $(document).ready(function() {
                     addDocumentToList(response.document);
                     $('#pdfFile').val(''); // Reset file input
                     enableChatInput();
+                } else if (response.status === 'accepted') {
+                    $('#pdfFile').val(''); // Reset file input
+                    pollJob(response.job_id, '#pdfUploadStatus');
                 } else {
                     showStatus('#pdfUploadStatus', response.message, 'error');
                 }
@@ -60,6 +63,10 @@ $(document).ready(function() {
         });
     });
     
+    $('#crawlSite').change(function() {
+        $('#crawlOptions').toggle(this.checked);
+    });
+
     // Process Website
     $('#processWebsiteBtn').click(function() {
         const url = $('#websiteUrl').val().trim();
@@ -75,13 +82,21 @@ $(document).ready(function() {
             url: '/process_website',
             type: 'POST',
             contentType: 'application/json',
-            data: JSON.stringify({ url: url }),
+            data: JSON.stringify($('#crawlSite').is(':checked') ? {
+                url: url,
+                crawl: true,
+                max_depth: parseInt($('#crawlDepth').val(), 10),
+                max_pages: parseInt($('#crawlPages').val(), 10)
+            } : { url: url }),
             success: function(response) {
                 if (response.status === 'success') {
                     showStatus('#websiteProcessStatus', response.message, 'success');
                     addDocumentToList(response.document);
                     $('#websiteUrl').val(''); // Reset URL input
                     enableChatInput();
+                } else if (response.status === 'accepted') {
+                    $('#websiteUrl').val(''); // Reset URL input
+                    pollJob(response.job_id, '#websiteProcessStatus');
                 } else {
                     showStatus('#websiteProcessStatus', response.message, 'error');
                 }
@@ -92,6 +107,49 @@ $(document).ready(function() {
         });
     });
     
+    // Poll an ingestion job until it finishes, showing stage and progress
+    function pollJob(jobId, statusSelector) {
+        $.ajax({
+            url: `/jobs/${jobId}`,
+            type: 'GET',
+            success: function(response) {
+                if (response.status !== 'success') {
+                    showStatus(statusSelector, response.message, 'error');
+                    return;
+                }
+
+                const job = response.job;
+                if (job.status === 'completed') {
+                    showStatus(statusSelector, job.result.message, 'success');
+                    addDocumentToList(job.result.document);
+                    enableChatInput();
+                } else if (job.status === 'failed') {
+                    showStatus(statusSelector, `Error processing document: ${job.error}`, 'error');
+                } else if (job.status === 'cancelled') {
+                    showStatus(statusSelector, 'Processing cancelled.', 'error');
+                } else {
+                    showStatus(statusSelector,
+                        `<div class="spinner"></div> ${job.stage} (${job.progress}%) ` +
+                        `<a href="#" class="cancel-job-link" data-job-id="${jobId}">Cancel</a>`,
+                        'loading');
+                    setTimeout(function() { pollJob(jobId, statusSelector); }, 1000);
+                }
+            },
+            error: function() {
+                showStatus(statusSelector, 'Lost track of the processing job.', 'error');
+            }
+        });
+    }
+
+    // Cancel an ingestion job
+    $(document).on('click', '.cancel-job-link', function(e) {
+        e.preventDefault();
+        $.ajax({
+            url: `/jobs/${$(this).data('job-id')}/cancel`,
+            type: 'POST'
+        });
+    });
+
     // Delete document handler
     $(document).on('click', '.delete-btn', function() {
         const docId = $(this).data('id');
@@ -115,6 +173,49 @@ $(document).ready(function() {
         });
     });
     
+    // Refresh document handler; a PDF needs its new version picked first
+    let refreshDocId = null;
+
+    function refreshDocument(data, isForm) {
+        showStatus('#refreshStatus', '<div class="spinner"></div> Refreshing document...', 'loading');
+        $.ajax({
+            url: '/refresh_document',
+            type: 'POST',
+            data: isForm ? data : JSON.stringify(data),
+            contentType: isForm ? false : 'application/json',
+            processData: !isForm,
+            success: function(response) {
+                if (response.status === 'accepted') {
+                    pollJob(response.job_id, '#refreshStatus');
+                } else {
+                    showStatus('#refreshStatus', response.message, 'error');
+                }
+            },
+            error: function() {
+                showStatus('#refreshStatus', 'An error occurred while refreshing the document.', 'error');
+            }
+        });
+    }
+
+    $(document).on('click', '.refresh-btn', function() {
+        refreshDocId = $(this).data('id');
+        if ($(this).data('type') === 'PDF') {
+            $('#refreshPdfFile').val('').click();
+        } else {
+            refreshDocument({ id: refreshDocId }, false);
+        }
+    });
+
+    $('#refreshPdfFile').change(function() {
+        if (this.files.length === 0) {
+            return;
+        }
+        const formData = new FormData();
+        formData.append('id', refreshDocId);
+        formData.append('file', this.files[0]);
+        refreshDocument(formData, true);
+    });
+
     // Ask button handler
     $('#askButton').click(function() {
         sendQuestion();
@@ -161,32 +262,97 @@ $(document).ready(function() {
         // Disable ask button
         $('#askButton').prop('disabled', true);
         
-        // Send request
-        $.ajax({
-            url: '/ask_question',
-            type: 'POST',
-            contentType: 'application/json',
-            data: JSON.stringify({ question: question }),
-            success: function(response) {
-                if (response.status === 'success') {
-                    // Add assistant message to chat
-                    addMessageToChat('assistant', response.response, response.metrics, response.query_id);
-                    
-                    // Clear status
-                    $('#chatStatus').html('');
-                } else {
-                    showStatus('#chatStatus', response.message, 'error');
-                }
-                
-                // Re-enable ask button
-                $('#askButton').prop('disabled', false);
+        // Stream the answer over Server-Sent Events; tokens are shown as
+        // plain text while they arrive and replaced by the rendered answer
+        fetch('/ask_question_stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Session-Id': SESSION_ID
             },
-            error: function() {
-                showStatus('#chatStatus', 'An error occurred while processing your question.', 'error');
-                $('#askButton').prop('disabled', false);
+            body: JSON.stringify({ question: question })
+        }).then(async function(response) {
+            if (!response.ok || !response.body) {
+                throw new Error('Bad response');
             }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let $streaming = null;
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    break;
+                }
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                    const event = parseSSE(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+
+                    if (event.type === 'token') {
+                        if (!$streaming) {
+                            $('#chatStatus').html('');
+                            $streaming = addStreamingMessage();
+                        }
+                        $streaming.append(document.createTextNode(event.data.text));
+                        $('#chatHistory').scrollTop($('#chatHistory')[0].scrollHeight);
+                    } else if (event.type === 'done') {
+                        if ($streaming) {
+                            $streaming.closest('.message').remove();
+                        }
+                        addMessageToChat('assistant', event.data.response, event.data.metrics, event.data.query_id);
+                        $('#chatStatus').html('');
+                    } else if (event.type === 'error') {
+                        if ($streaming) {
+                            $streaming.closest('.message').remove();
+                        }
+                        showStatus('#chatStatus', event.data.message, 'error');
+                    }
+                }
+            }
+        }).catch(function() {
+            showStatus('#chatStatus', 'An error occurred while processing your question.', 'error');
+        }).finally(function() {
+            // Re-enable ask button
+            $('#askButton').prop('disabled', false);
         });
     }
+
+    // Parse one Server-Sent Event block into its type and JSON data
+    function parseSSE(block) {
+        let type = 'message';
+        let data = '';
+        block.split('\n').forEach(function(line) {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                data += line.slice(5).trim();
+            }
+        });
+        return { type: type, data: data ? JSON.parse(data) : {} };
+    }
+
+    // Placeholder assistant message that receives streamed tokens
+    function addStreamingMessage() {
+        $('.no-chat').remove();
+        const $message = $(`
+            <div class="message assistant-message mb-3">
+                <div class="d-flex align-items-center mb-1">
+                    <div class="assistant-avatar bg-success text-white rounded-circle me-2">
+                        <i class="bi bi-robot"></i>
+                    </div>
+                    <strong>Assistant</strong>
+                </div>
+                <div class="message-content" style="white-space: pre-wrap;"></div>
+            </div>
+        `);
+        $('#chatHistory').append($message);
+        return $message.find('.message-content');
+    }
     
     // Function to add message to chat
     function addMessageToChat(role, content, metrics, queryId) {
@@ -216,9 +382,11 @@ $(document).ready(function() {
                 metricsHTML = `
                     <div class="metrics-row mt-1">
                         <span><i class="bi bi-clock"></i> ${metrics.latency}s</span>
+                        ${metrics.ttft !== undefined ? `<span><i class="bi bi-lightning"></i> ${metrics.ttft}s first token</span>` : ''}
                         <span><i class="bi bi-database"></i> ${metrics.chunks_count} chunks</span>
                         <span><i class="bi bi-arrow-right-circle"></i> ${metrics.tokens_input} in</span>
                         <span><i class="bi bi-arrow-left-circle"></i> ${metrics.tokens_output} out</span>
+                        ${metrics.cache_hit ? '<span><i class="bi bi-lightning-charge"></i> cached</span>' : ''}
                     </div>
                 `;
             }
@@ -286,6 +454,11 @@ $(document).ready(function() {
     function addDocumentToList(doc) {
         // Remove no-docs message if present
         $('.no-docs').remove();
+
+        // Duplicate uploads resolve to the same document
+        if ($(`.document-item[data-id="${doc.id}"]`).length) {
+            return;
+        }
         
         // const docHTML = `
         //     <div class="document-item card mb-2" data-id="${doc.id}">
@@ -311,9 +484,14 @@ $(document).ready(function() {
                             <span class="badge bg-info me-2 flex-shrink-0">${doc.type}</span>
                             <span class="text-truncate">${doc.name}</span>
                         </div>
-                        <button class="btn btn-sm btn-danger delete-btn flex-shrink-0" data-id="${doc.id}">
-                            <i class="bi bi-trash"></i>
-                        </button>
+                        <div class="d-flex flex-shrink-0">
+                            <button class="btn btn-sm btn-outline-secondary refresh-btn me-1" data-id="${doc.id}" data-type="${doc.type}" title="Refresh">
+                                <i class="bi bi-arrow-clockwise"></i>
+                            </button>
+                            <button class="btn btn-sm btn-danger delete-btn" data-id="${doc.id}">
+                                <i class="bi bi-trash"></i>
+                            </button>
+                        </div>
                     </div>
                 </div>
             </div>